@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Shared NSAttributedString decoder for iMessage attributedBody blobs
+The length byte counts UTF-8 bytes, not characters
+"""
+
+import re
+
+# Length-prefix patterns all end in 84 01 2b; the bytes before it pick the variant.
+# Prefixes are tried in order: 67 01 94 (standard), none (shorter), 01 94, 01 95.
+_ATTR_RE = re.compile(rb'(?P<prefix>\x67?\x01[\x94\x95])?\x84\x01\x2b')
+_ATTR_PREFIXES = (b'\x67\x01\x94', b'', b'\x01\x94', b'\x01\x95')
+# Control characters other than \t, \n and \r; decoded text is cut at the first one
+_CTRL_TRUNC = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+# Bytes that cannot start a UTF-8 sequence; spans beginning with one are never decoded
+_UTF8_NON_LEAD = frozenset(range(0x80, 0xC2)) | frozenset(range(0xF5, 0x100))
+# Finds any character str.isalnum() accepts: word characters other than '_'
+_HAS_ALNUM = re.compile(r'[^\W_]').search
+
+def decode_attributed_body(blob):
+    """
+    Correct decode of NSAttributedString
+    Length byte represents UTF-8 byte count, not character count
+    Handles multi-byte length encoding for messages > 127 bytes
+    """
+    if not blob:
+        return None
+
+    try:
+        # Look for NSString marker
+        nsstring_pos = blob.find(b'NSString')
+        if nsstring_pos == -1:
+            return None
+        blob_len = len(blob)
+        # Slices of a memoryview are decoded in place instead of copying the bytes first
+        view = memoryview(blob)
+
+        # Every length pattern ends in 84 01 2b; probe for it before any regex work,
+        # then scan for all the patterns in one pass starting just ahead of it
+        anchor = blob.find(b'\x84\x01\x2b', nsstring_pos)
+        anchors = [] if anchor == -1 else [
+            (m.group('prefix') or b'', m.end())
+            for m in _ATTR_RE.finditer(blob, max(nsstring_pos, anchor - 3))
+        ]
+
+        tried = set()
+        for prefix in _ATTR_PREFIXES:
+            # First occurrence of this pattern; the length byte follows it.
+            # Patterns often share an occurrence, which only needs decoding once.
+            length_pos = next((end for found, end in anchors if found.endswith(prefix)), None)
+            if length_pos is not None and length_pos not in tried:
+                tried.add(length_pos)
+                if length_pos < blob_len:
+                    length_byte = blob[length_pos]
+
+                    # Handle multi-byte length encoding
+                    # If high bit is set (>= 0x80), lower bits indicate how many bytes follow
+                    if length_byte >= 0x80:
+                        # Multi-byte length: lower 7 bits = number of following length bytes
+                        num_length_bytes = length_byte & 0x7F
+                        if num_length_bytes == 1 and length_pos + 2 < blob_len:
+                            # Single additional byte for length, plus null separator
+                            text_length = blob[length_pos + 1]
+                            # Skip: 0x81 + length_byte + 0x00 separator
+                            text_start = length_pos + 3
+                        elif num_length_bytes == 2 and length_pos + 3 < blob_len:
+                            # Two additional bytes for length (little-endian), plus null separator
+                            text_length = blob[length_pos + 1] | (blob[length_pos + 2] << 8)
+                            text_start = length_pos + 4
+                        else:
+                            continue
+                    else:
+                        # Single byte length (< 128)
+                        text_length = length_byte
+                        text_start = length_pos + 1
+
+                    # Validate and extract
+                    if 1 <= text_length <= 10000 and text_start + text_length <= blob_len:
+                        try:
+                            text_bytes = view[text_start:text_start + text_length]
+                            text = str(text_bytes, 'utf-8', 'strict')
+
+                            # Clean control characters (text ends at the first one)
+                            ctrl = _CTRL_TRUNC.search(text)
+                            clean_text = (text[:ctrl.start()] if ctrl else text).strip()
+
+                            if len(clean_text) > 0:
+                                return clean_text
+
+                        except UnicodeDecodeError:
+                            continue
+
+        # Fallback: scan for length + valid UTF-8 sequences
+        # Start searching after NSString
+        search_start = nsstring_pos + 8
+
+        for i in range(search_start, min(search_start + 100, blob_len - 10)):
+            potential_length = blob[i]
+
+            # Try reasonable lengths
+            if 2 <= potential_length <= 200:
+                text_start = i + 1
+                if text_start + potential_length <= blob_len and blob[text_start] not in _UTF8_NON_LEAD:
+                    try:
+                        # Extract the exact number of bytes
+                        text_bytes = view[text_start:text_start + potential_length]
+
+                        # Try to decode as UTF-8
+                        text = str(text_bytes, 'utf-8', 'strict')
+
+                        # Validate it looks like a message
+                        if _HAS_ALNUM(text) and not text.startswith(('NS', '__')):
+
+                            # Clean control chars (text ends at the first one)
+                            ctrl = _CTRL_TRUNC.search(text)
+                            clean_text = (text[:ctrl.start()] if ctrl else text).strip()
+
+                            if len(clean_text) >= 2:
+                                return clean_text
+
+                    except UnicodeDecodeError:
+                        # Not valid UTF-8 at this position
+                        continue
+
+    except Exception as e:
+        pass
+
+    return None
@@ -4,33 +4,40 @@ Extract contacts from various export formats and update iMessage data.
 Now saves to persistent contact_mappings.json for reuse across extractions.
 """
 
-import json
 import re
 import os
-import glob
+import mmap
+import shutil
+from functools import lru_cache
+
+from export_utils import DIGITS_ONLY, iter_contacts, read_json, write_json
 
 MAPPINGS_FILE = 'contact_mappings.json'
+# A card ends at the first END:VCARD before the next BEGIN:VCARD; an unterminated card is dropped
+_VCARD_RE = re.compile(rb'BEGIN:VCARD((?:(?!BEGIN:VCARD).)*?)END:VCARD', re.DOTALL)
+_VCARD_FIELD_RE = re.compile(
+    rb'^[ \t]*(?:FN:(?P<fn>.*)|N:(?P<n>.*)|TEL[^:\n]*:(?P<tel>.*))$', re.MULTILINE)
 
 def load_mappings():
     """Load existing mappings"""
     if os.path.exists(MAPPINGS_FILE):
-        with open(MAPPINGS_FILE, 'r') as f:
-            return json.load(f)
+        return read_json(MAPPINGS_FILE)
     return {"version": 1, "phone_to_name": {}, "group_chats": {}}
 
 def save_mappings(mappings):
     """Save mappings to file"""
-    with open(MAPPINGS_FILE, 'w') as f:
-        json.dump(mappings, f, indent=2)
+    # The mappings file is documented for users to inspect, so keep it readable
+    write_json(MAPPINGS_FILE, mappings, pretty=True)
     print(f"✅ Saved mappings to {MAPPINGS_FILE}")
 
+@lru_cache(maxsize=8192)
 def clean_phone_number(phone):
     """Clean and normalize phone number for matching"""
     if not phone:
         return ""
     
     # Remove all non-digit characters
-    cleaned = re.sub(r'\D', '', str(phone))
+    cleaned = str(phone).translate(DIGITS_ONLY)
     
     # Handle different lengths
     if len(cleaned) == 10:  # US number without country code
@@ -40,6 +47,23 @@ def clean_phone_number(phone):
     
     return cleaned
 
+@lru_cache(maxsize=8192)
+def phone_variants(phone):
+    """Return every format a phone number is stored under in the contacts map"""
+    cleaned = clean_phone_number(phone)
+    variants = (
+        phone.strip(),
+        cleaned,
+        f"+{cleaned}",
+        f"+1{cleaned[-10:]}" if len(cleaned) >= 10 else None,
+    )
+    return tuple(variant for variant in variants if variant)
+
+def list_export_files():
+    """List the visible files in the current directory in one scan"""
+    with os.scandir('.') as entries:
+        return [entry.name for entry in entries if entry.is_file() and not entry.name.startswith('.')]
+
 def export_contacts_to_vcf():
     """Create instructions for exporting contacts to VCF format"""
     
@@ -68,7 +92,8 @@ def export_contacts_to_vcf():
 def parse_vcf_file():
     """Parse VCF file and extract contacts"""
     
-    vcf_files = glob.glob("*.vcf") + glob.glob("contacts.*")
+    names = list_export_files()
+    vcf_files = [n for n in names if n.endswith('.vcf')] + [n for n in names if n.startswith('contacts.')]
     
     if not vcf_files:
         print("No VCF files found. Please export your contacts as described above.")
@@ -80,65 +105,44 @@ def parse_vcf_file():
     contacts_map = {}
     
     try:
-        with open(vcf_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # Split into individual contact cards
-        cards = content.split('BEGIN:VCARD')
-        
-        for card in cards[1:]:  # Skip the first empty split
-            if 'END:VCARD' not in card:
-                continue
-                
-            name = ""
-            phones = []
-            
-            lines = card.split('\n')
-            for line in lines:
-                line = line.strip()
-                
-                # Extract name
-                if line.startswith('FN:'):
-                    name = line[3:].strip()
-                elif line.startswith('N:'):
-                    # Format: N:Last;First;Middle;Prefix;Suffix
-                    parts = line[2:].split(';')
-                    if len(parts) >= 2:
-                        last = parts[0].strip()
-                        first = parts[1].strip()
-                        if first and last:
-                            name = f"{first} {last}"
-                        elif first:
-                            name = first
-                        elif last:
-                            name = last
-                
-                # Extract phone numbers
-                if line.startswith('TEL'):
-                    # Extract phone number from various formats
-                    if ':' in line:
-                        phone = line.split(':', 1)[1].strip()
-                        phones.append(phone)
-            
-            # Store mappings
-            if name and phones:
-                for phone in phones:
-                    cleaned = clean_phone_number(phone)
-                    original = phone.strip()
-                    
-                    # Store multiple formats
-                    phone_variants = [
-                        original,
-                        cleaned,
-                        f"+{cleaned}",
-                        f"+1{cleaned[-10:]}" if len(cleaned) >= 10 else None,
-                    ]
+        with open(vcf_file, 'rb') as f:
+            # Map the file and scan it directly; only the matched fields are decoded
+            size = os.fstat(f.fileno()).st_size
+            with (mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else memoryview(b'')) as content:
+                # Scan each contact card for its FN, N and TEL fields
+                for card in _VCARD_RE.finditer(content):
+                    name = ""
+                    phones = []
                     
-                    for variant in phone_variants:
-                        if variant:
-                            contacts_map[variant] = name
+                    for field in _VCARD_FIELD_RE.finditer(card.group(1)):
+                        fn, n, tel = (value.decode('utf-8', 'replace') if value is not None else None
+                                      for value in field.group('fn', 'n', 'tel'))
+                        
+                        # Extract name
+                        if fn is not None:
+                            name = fn.strip()
+                        elif n is not None:
+                            # Format: N:Last;First;Middle;Prefix;Suffix
+                            parts = n.split(';')
+                            if len(parts) >= 2:
+                                last = parts[0].strip()
+                                first = parts[1].strip()
+                                if first and last:
+                                    name = f"{first} {last}"
+                                elif first:
+                                    name = first
+                                elif last:
+                                    name = last
+                        
+                        # Extract phone numbers
+                        else:
+                            phones.append(tel.strip())
                     
-                    print(f"  {name}: {original}")
+                    # Store mappings under multiple formats
+                    if name and phones:
+                        for phone in phones:
+                            contacts_map.update(dict.fromkeys(phone_variants(phone), name))
+                            print(f"  {name}: {phone.strip()}")
         
         print(f"\nExtracted {len(contacts_map)} phone-to-name mappings")
         
@@ -150,8 +154,7 @@ def parse_vcf_file():
 def parse_csv_file():
     """Parse CSV file and extract contacts"""
     
-    csv_files = glob.glob("*.csv") + glob.glob("contacts.*")
-    csv_files = [f for f in csv_files if f.endswith('.csv')]
+    csv_files = [n for n in list_export_files() if n.endswith('.csv')]
     
     if not csv_files:
         print("No CSV files found.")
@@ -197,24 +200,11 @@ def parse_csv_file():
                     if row[field]:
                         phones.append(row[field].strip())
                 
-                # Store mappings
+                # Store mappings under multiple formats
                 if name and phones:
                     for phone in phones:
-                        cleaned = clean_phone_number(phone)
-                        original = phone.strip()
-                        
-                        phone_variants = [
-                            original,
-                            cleaned,
-                            f"+{cleaned}",
-                            f"+1{cleaned[-10:]}" if len(cleaned) >= 10 else None,
-                        ]
-                        
-                        for variant in phone_variants:
-                            if variant:
-                                contacts_map[variant] = name
-                        
-                        print(f"  {name}: {original}")
+                        contacts_map.update(dict.fromkeys(phone_variants(phone), name))
+                        print(f"  {name}: {phone.strip()}")
         
         print(f"\nExtracted {len(contacts_map)} phone-to-name mappings")
         
@@ -232,13 +222,9 @@ def manual_entry():
     print("Press Enter without typing anything to finish.")
     print()
     
-    # Load current data to show what needs updating
-    with open('imessage_data.json', 'r') as f:
-        data = json.load(f)
-    
-    # Find contacts that need names
+    # Find contacts that need names, without loading every message
     unresolved = []
-    for contact in data.get('contacts', []):
+    for contact in iter_contacts('imessage_data.json'):
         phone = contact.get('phone', '')
         name = contact.get('name', '')
         
@@ -290,8 +276,16 @@ def update_contacts_with_mapping(contacts_map):
     save_mappings(mappings)
 
     # Load the JSON data
-    with open('imessage_data.json', 'r') as f:
-        data = json.load(f)
+    data = read_json('imessage_data.json')
+
+    # Index every mapping under its normalized forms once, so each contact is a few dict lookups
+    lookup = dict(contacts_map)
+    for key, name in contacts_map.items():
+        cleaned = clean_phone_number(key)
+        if cleaned:
+            lookup.setdefault(cleaned, name)
+            if len(cleaned) >= 10:
+                lookup.setdefault(cleaned[-10:], name)
 
     updated_count = 0
 
@@ -303,25 +297,13 @@ def update_contacts_with_mapping(contacts_map):
         if current_name and not current_name.startswith('+') and not current_name.startswith('chat') and '@' not in current_name:
             continue
 
-        # Try to find a match
-        new_name = None
-
-        if phone in contacts_map:
-            new_name = contacts_map[phone]
-        else:
-            # Try partial matching
-            cleaned = clean_phone_number(phone)
-            test_variants = [
-                cleaned,
-                f"+{cleaned}",
-                f"+1{cleaned[-10:]}" if len(cleaned) >= 10 else None,
-                cleaned[-10:] if len(cleaned) >= 10 else None,
-            ]
-
-            for variant in test_variants:
-                if variant and variant in contacts_map:
-                    new_name = contacts_map[variant]
-                    break
+        # Try to find a match, falling back to partial matching
+        cleaned = clean_phone_number(phone)
+        new_name = (
+            lookup.get(phone)
+            or lookup.get(cleaned)
+            or (lookup.get(cleaned[-10:]) if len(cleaned) >= 10 else None)
+        )
 
         if new_name:
             print(f"  {current_name} -> {new_name}")
@@ -330,12 +312,9 @@ def update_contacts_with_mapping(contacts_map):
 
     if updated_count > 0:
         # Backup and save
-        with open('imessage_data_before_contact_update.json', 'w') as f:
-            with open('imessage_data.json', 'r') as original:
-                f.write(original.read())
+        shutil.copyfile('imessage_data.json', 'imessage_data_before_contact_update.json')
 
-        with open('imessage_data.json', 'w') as f:
-            json.dump(data, f, indent=2)
+        write_json('imessage_data.json', data)
 
         print(f"\nUpdated {updated_count} contacts in JSON!")
         print("Backup saved to imessage_data_before_contact_update.json")
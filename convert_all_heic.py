@@ -3,17 +3,94 @@
 Convert all HEIC images to JPEG and update JSON paths
 """
 
-import json
 import os
 import subprocess
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor
 import time
 
+from export_utils import fast_copy, is_heic, read_json, write_json
+
+try:
+    from PIL import Image
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    Image = None
+
+try:
+    from Foundation import NSURL
+    from Quartz import (
+        CGImageSourceCreateWithURL,
+        CGImageDestinationCreateWithURL,
+        CGImageDestinationAddImageFromSource,
+        CGImageDestinationFinalize,
+        kCGImageDestinationLossyCompressionQuality,
+    )
+except ImportError:
+    NSURL = None
+
+MANIFEST_FILE = '.web_ready_manifest.json'
+
+def existing_paths(paths):
+    """Map each existing file to its directory entry (None if matched only by name), listing each directory once"""
+    by_dir = {}
+    for path in paths:
+        by_dir.setdefault(os.path.dirname(path), []).append(path)
+
+    found = {}
+    for directory, members in by_dir.items():
+        try:
+            with os.scandir(directory or '.') as entries:
+                listed = {entry.name: entry for entry in entries}
+        except OSError:
+            listed = {}
+        for path in members:
+            entry = listed.get(os.path.basename(path))
+            if entry is not None:
+                # The file type comes with the listing, so no stat is needed here
+                if entry.is_file():
+                    found[path] = entry
+            elif os.path.isfile(path):
+                # Names can differ only by case on case-insensitive volumes, so confirm misses
+                found[path] = None
+    return found
+
+def source_key(path, entry):
+    """Return a "size:mtime_ns" key that changes whenever a source file does"""
+    try:
+        st = entry.stat() if entry is not None else os.stat(path)
+    except OSError:
+        return None
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
 def convert_heic_file(args):
     """Convert a single HEIC file to JPEG"""
     heic_path, jpeg_path = args
 
+    if NSURL is not None:
+        # Convert through ImageIO, which decodes HEIC on the hardware HEVC block
+        try:
+            source = CGImageSourceCreateWithURL(NSURL.fileURLWithPath_(str(heic_path)), None)
+            dest = CGImageDestinationCreateWithURL(
+                NSURL.fileURLWithPath_(str(jpeg_path)), 'public.jpeg', 1, None)
+            if source is not None and dest is not None:
+                CGImageDestinationAddImageFromSource(
+                    dest, source, 0, {kCGImageDestinationLossyCompressionQuality: 0.85})
+                if CGImageDestinationFinalize(dest):
+                    return True
+        except Exception:
+            pass
+
+    if Image is not None:
+        # Decode and encode in-process with pillow-heif, no subprocess per file
+        try:
+            with Image.open(heic_path) as img:
+                img.convert('RGB').save(jpeg_path, 'JPEG', quality=85)
+            return True
+        except Exception:
+            pass
+
     try:
         # Use macOS sips command for conversion
         result = subprocess.run(
@@ -35,20 +112,32 @@ def convert_all_heic():
     web_dir.mkdir(exist_ok=True)
 
     # Load current data
-    with open('imessage_data.json', 'r') as f:
-        data = json.load(f)
+    data = read_json('imessage_data.json')
+
+    # Resolve each image's source path once; both passes below reuse it
+    # Handle both 'url' and 'path' field names for compatibility
+    paths = [img.get('url') or img.get('path') or img.get('filename', '') for img in data['images']]
 
     # Find all HEIC files
     heic_images = []
     other_images = []
 
-    for img in data['images']:
-        # Handle both 'url' and 'path' field names for compatibility
-        url = img.get('url') or img.get('path') or img.get('filename', '')
-        if url.lower().endswith(('.heic', '.heif')):
-            heic_images.append(img)
+    for img, url in zip(data['images'], paths):
+        # Expand home directory if needed
+        url = os.path.expanduser(url)
+        if is_heic(url):
+            heic_images.append((img, url))
         else:
-            other_images.append(img)
+            other_images.append((img, url))
+
+    available = existing_paths(path for _, path in heic_images + other_images)
+    with os.scandir(web_dir) as entries:
+        web_names = {entry.name for entry in entries}
+
+    # Sources already processed, so changed ones are redone and unchanged ones skipped
+    manifest = read_json(MANIFEST_FILE) if os.path.exists(MANIFEST_FILE) else {}
+    claimed = set()
+    stamps = {}  # Source keys, only computed for the files that claim a name
 
     print(f"Found {len(heic_images)} HEIC files to convert")
     print(f"Found {len(other_images)} already compatible files")
@@ -57,25 +146,27 @@ def convert_all_heic():
     conversion_tasks = []
     updated_images = []
 
-    for img in heic_images:
-        current_path = img.get('url') or img.get('path') or img.get('filename', '')
-        # Expand home directory if needed
-        current_path = os.path.expanduser(current_path)
-        if os.path.exists(current_path):
+    for img, current_path in heic_images:
+        if current_path in available:
             # Create JPEG filename
             original_name = Path(current_path).stem
             jpeg_name = f"{original_name}.jpg"
             jpeg_path = web_dir / jpeg_name
 
-            # Add to conversion queue if not already exists
-            if not jpeg_path.exists():
-                conversion_tasks.append((current_path, jpeg_path))
-
-            # Update image data to point to JPEG
-            img_copy = img.copy()
-            img_copy['url'] = f"web_ready_images/{jpeg_name}"
-            img_copy['mimeType'] = 'image/jpeg'
-            updated_images.append(img_copy)
+            # Add to conversion queue if not already exists or its source changed
+            if jpeg_name not in claimed:
+                stamps[current_path] = source_key(current_path, available[current_path])
+                entry = [stamps[current_path], jpeg_name]
+                if jpeg_name not in web_names or manifest.get(current_path, entry) != entry:
+                    conversion_tasks.append((current_path, jpeg_path))
+                else:
+                    manifest[current_path] = entry
+                claimed.add(jpeg_name)
+
+            # Update image data to point to JPEG; the loaded dicts are ours to mutate
+            img['url'] = f"web_ready_images/{jpeg_name}"
+            img['mimeType'] = 'image/jpeg'
+            updated_images.append(img)
         else:
             # File doesn't exist, skip
             print(f"⚠️  File not found: {current_path}")
@@ -85,36 +176,43 @@ def convert_all_heic():
         print(f"Converting {len(conversion_tasks)} HEIC files...")
 
         converted = 0
-        with ThreadPoolExecutor(max_workers=4) as executor:
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 4) as executor:
             results = list(executor.map(convert_heic_file, conversion_tasks))
             converted = sum(results)
 
+        for (heic_path, jpeg_path), ok in zip(conversion_tasks, results):
+            if ok:
+                manifest[heic_path] = [stamps[heic_path], jpeg_path.name]
+
         print(f"✅ Successfully converted {converted}/{len(conversion_tasks)} files")
 
     # Copy other compatible files to web directory
     print("📁 Copying other image files...")
     copied = 0
 
-    for img in other_images:
-        current_path = img.get('url') or img.get('path') or img.get('filename', '')
-        # Expand home directory if needed
-        current_path = os.path.expanduser(current_path)
-        if os.path.exists(current_path):
+    for img, current_path in other_images:
+        if current_path in available:
             filename = Path(current_path).name
             dest_path = web_dir / filename
 
-            if not dest_path.exists():
-                try:
-                    import shutil
-                    shutil.copy2(current_path, dest_path)
-                    copied += 1
-                except:
-                    pass
+            if filename not in claimed:
+                stamps[current_path] = source_key(current_path, available[current_path])
+                entry = [stamps[current_path], filename]
+                if filename not in web_names or manifest.get(current_path, entry) != entry:
+                    try:
+                        fast_copy(current_path, dest_path)
+                        manifest[current_path] = entry
+                        claimed.add(filename)
+                        copied += 1
+                    except:
+                        pass
+                else:
+                    manifest[current_path] = entry
+                    claimed.add(filename)
 
             # Update path to web directory
-            img_copy = img.copy()
-            img_copy['url'] = f"web_ready_images/{filename}"
-            updated_images.append(img_copy)
+            img['url'] = f"web_ready_images/{filename}"
+            updated_images.append(img)
         else:
             print(f"⚠️  File not found: {current_path}")
 
@@ -124,8 +222,8 @@ def convert_all_heic():
     data['images'] = updated_images
 
     # Save updated data
-    with open('imessage_data.json', 'w') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    write_json('imessage_data.json', data)
+    write_json(MANIFEST_FILE, manifest)
 
     # Final verification
     web_compatible = 0
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Shared helpers for the export scripts
+JSON files are read with orjson and streamed with ijson when they are installed,
+the macOS databases are only ever opened read-only,
+files are cloned on APFS instead of copied,
+and contacts are looked up in Contacts.app through one shared AppleScript
+"""
+
+import os
+import sys
+import json
+import sqlite3
+from pathlib import Path
+from functools import lru_cache
+# ctypes, shutil, subprocess and the other modules only some helpers need are imported
+# inside those helpers, so a script only pays for the ones it actually calls
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+class _DigitsOnly(dict):
+    """str.translate table that deletes every character \\D matches, filled in lazily"""
+    def __missing__(self, codepoint):
+        self[codepoint] = codepoint if chr(codepoint).isdecimal() else None
+        return self[codepoint]
+
+# phone.translate(DIGITS_ONLY) strips everything but the digits, like re.sub(r'\D', '', phone)
+DIGITS_ONLY = _DigitsOnly()
+
+# Punctuation allowed in a phone number, stripped in one pass before an isdigit() check
+PHONE_PUNCT = str.maketrans('', '', '-() ')
+
+@lru_cache(maxsize=4096)
+def phone_lookup_keys(phone):
+    """Return the normalized digits and last-10-digit fallback used to look up a phone"""
+    # Depends only on the phone, so the cache stays valid as mappings are updated
+    cleaned = str(phone).translate(DIGITS_ONLY)
+    if len(cleaned) == 10:
+        cleaned = '1' + cleaned
+    return cleaned, cleaned[-10:] if len(cleaned) >= 10 else None
+
+@lru_cache(maxsize=8192)
+def mapping_keys(phone):
+    """Return the original and normalized formats a phone is stored under in contact_mappings.json"""
+    keys = [phone]
+    cleaned, last10 = phone_lookup_keys(phone)
+    if cleaned:
+        keys += [f"+{cleaned}", cleaned]
+        if last10:
+            keys.append(last10)
+    return tuple(keys)
+
+def build_phone_index(phone_to_name):
+    """Index mapped names by normalized digits so resolving a phone is one or two dict lookups"""
+    # Normalized digits never have exactly 10 digits (a leading 1 is added), so 10-digit keys
+    # only ever hold the last-10-digit fallback and the two kinds of key cannot collide.
+    # Preferred forms are assigned first so the fallbacks below only fill the gaps.
+    index = {}
+    for key, name in phone_to_name.items():
+        if len(key) == 12 and key.startswith('+1') and key[2:].isdecimal():
+            index[key[2:]] = name
+        elif len(key) != 10 and key.isdecimal():
+            index[key] = name
+    for key, name in phone_to_name.items():
+        if len(key) == 10 and key.isdecimal():
+            index.setdefault(key, name)
+        elif key.startswith('+') and len(key) != 11 and (key[1:].isdecimal() or key == '+'):
+            index.setdefault(key[1:], name)
+    return index
+
+def resolve_contact_name(phone, phone_to_name, phone_index):
+    """Look up contact name from mappings and their index from build_phone_index"""
+    if phone in phone_to_name:
+        return phone_to_name[phone]
+
+    cleaned, last10 = phone_lookup_keys(phone)
+    name = phone_index.get(cleaned)
+    if name is None and last10:
+        name = phone_index.get(last10)
+    return name
+
+def connect_read_only(db_path):
+    """Open a macOS app's SQLite database read-only with a large page cache and memory-mapped reads"""
+    # Read-only, so the app that owns the database is never contended with for a write lock.
+    # The journal mode is left alone: it belongs to that app, not these scripts.
+    conn = sqlite3.connect(f"{Path(db_path).as_uri()}?mode=ro", uri=True)
+    conn.execute('PRAGMA query_only=1')
+    conn.execute('PRAGMA cache_size=-65536')  # 64 MB
+    conn.execute('PRAGMA mmap_size=268435456')  # 256 MB
+    return conn
+
+_HEIC_EXTS = frozenset({'heic', 'heif'})
+
+def is_heic(name):
+    """Return True if a file name has a HEIC/HEIF extension"""
+    return name.rpartition('.')[2].lower() in _HEIC_EXTS
+
+def taken_names(directory):
+    """Return the names already in a directory, casefolded for unique_name"""
+    with os.scandir(directory) as entries:
+        return {entry.name.casefold() for entry in entries}
+
+def unique_name(used_names, filename):
+    """Return filename, or its first _N variant, that is not taken in used_names"""
+    # Casefolded because APFS treats names that differ only in case as the same file
+    if filename.casefold() not in used_names:
+        return filename
+    stem, dot, ext = filename.rpartition('.')
+    counter = 1
+    while True:
+        candidate = f"{stem}_{counter}.{ext}" if dot else f"{filename}_{counter}"
+        if candidate.casefold() not in used_names:
+            return candidate
+        counter += 1
+
+@lru_cache(maxsize=None)
+def _load_clonefile():
+    """Look up clonefile(2), which makes copy-on-write copies on APFS"""
+    if sys.platform != 'darwin':
+        return None
+    import ctypes
+    try:
+        clonefile = ctypes.CDLL(None, use_errno=True).clonefile
+    except (OSError, AttributeError):
+        return None
+    clonefile.argtypes = (ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int)
+    clonefile.restype = ctypes.c_int
+    return clonefile
+
+def fast_copy(src, dst):
+    """Copy a file, cloning it instead of duplicating its data when possible"""
+    clonefile = _load_clonefile()
+    if clonefile is not None and clonefile(os.fsencode(src), os.fsencode(dst), 0) == 0:
+        return
+    import shutil
+    shutil.copy2(src, dst)
+
+# The columns and joins both message exports read from chat.db; each query adds its own
+# extra columns, filter, ordering and limit around them
+MESSAGE_COLUMNS = """
+        m.ROWID as message_id,
+        m.text as message_text,
+        -- The blob is only needed, and so only read, when there is no plain text
+        CASE WHEN COALESCE(m.text, '') = '' THEN m.attributedBody END as attributed_body,
+        m.is_from_me,
+        datetime(m.date / 1000000000 + strftime('%s', '2001-01-01'), 'unixepoch', 'localtime') as message_date,
+        h.id as contact_identifier,
+        c.chat_identifier,
+        c.display_name as chat_display_name,
+        m.service"""
+MESSAGE_JOINS = """
+    FROM message m
+    -- One row per message: a message in several chats is attributed to the lowest chat ROWID,
+    -- so no DISTINCT over the wide columns is needed to drop the duplicates the join produced
+    LEFT JOIN chat c ON c.ROWID = (
+        SELECT MIN(cmj.chat_id) FROM chat_message_join cmj WHERE cmj.message_id = m.ROWID
+    )
+    LEFT JOIN handle h ON m.handle_id = h.ROWID"""
+
+def parse_json(raw):
+    """Parse a JSON document from bytes or str, using orjson when it is installed"""
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+def read_json(path):
+    """Read a JSON file, using orjson when it is installed"""
+    with open(path, 'rb') as f:
+        return parse_json(f.read())
+
+def write_json(path, data, pretty=False):
+    """Write a JSON file, compact unless pretty, using orjson when it is installed"""
+    if orjson:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 if pretty else None))
+    elif pretty:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, separators=(',', ':'), ensure_ascii=False)
+
+def iter_contacts(path):
+    """Yield the contacts in a data file, streaming them when ijson is installed"""
+    if ijson:
+        with open(path, 'rb') as f:
+            yield from ijson.items(f, 'contacts.item')
+    else:
+        yield from read_json(path).get('contacts', [])
+
+# Looks up the identifier passed as the first argument and prints the contact's name
+LOOKUP_SCRIPT = '''
+on run argv
+    set identifier to item 1 of argv
+    tell application "Contacts"
+        set foundPeople to {}
+        
+        -- Search by phone number
+        try
+            set foundPeople to foundPeople & (every person whose value of every phone contains identifier)
+        end try
+        
+        -- Search by email
+        try
+            set foundPeople to foundPeople & (every person whose value of every email contains identifier)
+        end try
+        
+        if (count of foundPeople) > 0 then
+            set thePerson to item 1 of foundPeople
+            set firstName to first name of thePerson
+            set lastName to last name of thePerson
+            
+            if firstName is missing value then set firstName to ""
+            if lastName is missing value then set lastName to ""
+            
+            if firstName is not "" and lastName is not "" then
+                return firstName & " " & lastName
+            else if firstName is not "" then
+                return firstName
+            else if lastName is not "" then
+                return lastName
+            else
+                return ""
+            end if
+        else
+            return ""
+        end if
+    end tell
+end run
+'''
+
+@lru_cache(maxsize=None)
+def osascript_command(script):
+    """Return the osascript command for a script, compiled once into a cached .scpt when possible"""
+    import hashlib
+    import subprocess
+    import tempfile
+    # The file name carries a hash of the source, so an edited script gets a fresh compile
+    digest = hashlib.sha1(script.encode('utf-8')).hexdigest()[:12]
+    compiled = Path(tempfile.gettempdir()) / f"contacts_lookup_{digest}.scpt"
+    if not compiled.exists():
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(suffix='.scpt', dir=compiled.parent)
+            os.close(fd)
+            subprocess.run(['osacompile', '-o', tmp_path, '-e', script],
+                          capture_output=True, check=True, timeout=30)
+            os.replace(tmp_path, compiled)
+        except Exception:
+            # No osacompile or it failed, so let osascript compile the source each run
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return ('osascript', '-e', script)
+    return ('osascript', str(compiled))
+
+def lookup_contact_via_applescript(identifier):
+    """Resolve contact name using AppleScript"""
+    import subprocess
+    try:
+        # Pass the identifier as an argument so the script text never changes,
+        # can be compiled once, and quotes in the identifier cannot break out of it
+        result = subprocess.run([*osascript_command(LOOKUP_SCRIPT), identifier.strip()], 
+                              capture_output=True, text=True, timeout=5)
+        
+        if result.returncode == 0 and result.stdout.strip():
+            return result.stdout.strip()
+    
+    except Exception as e:
+        print(f"AppleScript error for {identifier}: {e}")
+    
+    return None
+
+# Looks up every identifier passed as an argument and prints "<index>\t<name>" for each
+BATCH_LOOKUP_SCRIPT = '''
+on run argv
+    set output to ""
+    tell application "Contacts"
+        repeat with i from 1 to count of argv
+            set identifier to item i of argv
+            set theName to ""
+            set foundPeople to {}
+            
+            -- Search by phone number
+            try
+                set foundPeople to foundPeople & (every person whose value of every phone contains identifier)
+            end try
+            
+            -- Search by email
+            try
+                set foundPeople to foundPeople & (every person whose value of every email contains identifier)
+            end try
+            
+            if (count of foundPeople) > 0 then
+                set thePerson to item 1 of foundPeople
+                set firstName to first name of thePerson
+                set lastName to last name of thePerson
+                
+                if firstName is missing value then set firstName to ""
+                if lastName is missing value then set lastName to ""
+                
+                if firstName is not "" and lastName is not "" then
+                    set theName to firstName & " " & lastName
+                else if firstName is not "" then
+                    set theName to firstName
+                else if lastName is not "" then
+                    set theName to lastName
+                end if
+            end if
+            
+            set output to output & i & tab & theName & linefeed
+        end repeat
+    end tell
+    return output
+end run
+'''
+
+def lookup_contacts_via_applescript(identifiers):
+    """Resolve many contacts with one AppleScript run, falling back to one run per contact"""
+    import subprocess
+    from concurrent.futures import ThreadPoolExecutor
+    resolved = {}
+    if not identifiers:
+        return resolved
+    try:
+        result = subprocess.run([*osascript_command(BATCH_LOOKUP_SCRIPT), *(i.strip() for i in identifiers)],
+                              capture_output=True, text=True, timeout=5 * len(identifiers))
+        if result.returncode == 0:
+            for line in result.stdout.splitlines():
+                index, _, name = line.partition('\t')
+                if index.isdigit() and name.strip():
+                    resolved[identifiers[int(index) - 1]] = name.strip()
+            return resolved
+        print(f"Batch AppleScript lookup failed: {result.stderr.strip()}")
+    except Exception as e:
+        print(f"Batch AppleScript lookup failed: {e}")
+    
+    # Fall back to looking up each contact on its own, a few at a time since
+    # each run spends most of its time waiting on Contacts
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        names = executor.map(lookup_contact_via_applescript, identifiers)
+        for i, (identifier, name) in enumerate(zip(identifiers, names)):
+            if i % 10 == 0:
+                print(f"  Processing {i}/{len(identifiers)}...")
+            if name:
+                resolved[identifier] = name
+    return resolved
@@ -5,12 +5,15 @@ Copies files, converts HEIC to JPEG, and updates JSON
 """
 
 import os
-import sqlite3
-import json
-import shutil
 import subprocess
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from export_utils import (
+    DIGITS_ONLY, connect_read_only, fast_copy, is_heic, parse_json, read_json,
+    taken_names, unique_name, write_json,
+)
 
 def find_chat_db():
     """Find iMessage chat database"""
@@ -23,8 +26,7 @@ def clean_phone_number(phone):
     """Clean and normalize phone number for matching"""
     if not phone:
         return ""
-    import re
-    cleaned = re.sub(r'\D', '', str(phone))
+    cleaned = str(phone).translate(DIGITS_ONLY)
     if len(cleaned) == 10:
         cleaned = '1' + cleaned
     elif len(cleaned) == 11 and cleaned.startswith('1'):
@@ -39,13 +41,23 @@ def extract_attachments(limit=500):
         print("❌ No iMessage database found")
         return []
 
-    conn = sqlite3.connect(db_path)
+    conn = connect_read_only(db_path)
     cursor = conn.cursor()
 
     print(f"📎 Extracting up to {limit} recent attachments...")
 
-    # Query for attachments with contact info
+    # Query for attachments with contact info, built into one JSON array by SQLite
     query = """
+    SELECT json_group_array(json_object(
+        'filename', filename,
+        'mimeType', mime_type,
+        'transferName', transfer_name,
+        'date', message_date,
+        'isFromMe', json(CASE WHEN is_from_me THEN 'true' ELSE 'false' END),
+        'contactId', contact_identifier,
+        'contactName', NULLIF(chat_display_name, '')
+    ))
+    FROM (
     SELECT DISTINCT
         a.filename,
         a.mime_type,
@@ -70,38 +82,30 @@ def extract_attachments(limit=500):
              OR a.filename LIKE '%.gif')
     ORDER BY m.date DESC
     LIMIT ?
+    )
     """
 
     cursor.execute(query, (limit,))
-    results = cursor.fetchall()
-
-    print(f"Found {len(results)} image attachments")
-
-    attachments = []
-    for row in results:
-        filename, mime_type, transfer_name, date, is_from_me, contact_id, display_name = row
-
-        # Resolve contact name
-        contact_name = display_name or contact_id
-        if contact_id and not display_name:
-            if contact_id.startswith('+'):
-                contact_name = clean_phone_number(contact_id)
-
-        attachments.append({
-            'filename': filename,
-            'mimeType': mime_type,
-            'transferName': transfer_name,
-            'date': date,
-            'isFromMe': bool(is_from_me),
-            'contactId': contact_id,
-            'contactName': contact_name
-        })
-
+    payload = cursor.fetchone()[0]
     conn.close()
+
+    attachments = parse_json(payload)
+    # json_group_array does not promise to keep the subquery's order, so restore newest-first here
+    attachments.sort(key=lambda att: att['date'] or '', reverse=True)
+    print(f"Found {len(attachments)} image attachments")
+
+    # Fall back to the contact identifier when the chat has no display name
+    for att in attachments:
+        if not att['contactName']:
+            contact_id = att['contactId']
+            if contact_id and contact_id.startswith('+'):
+                contact_id = clean_phone_number(contact_id)
+            att['contactName'] = contact_id
+
     return attachments
 
-def copy_attachments(attachments, output_dir="imessage_attachments"):
-    """Copy attachment files to local directory"""
+def copy_attachments(attachments, output_dir="imessage_attachments", on_copied=None):
+    """Copy attachment files to local directory, calling on_copied for each copied file"""
 
     output_path = Path(output_dir)
     output_path.mkdir(exist_ok=True)
@@ -110,6 +114,9 @@ def copy_attachments(attachments, output_dir="imessage_attachments"):
     skipped = 0
     errors = 0
 
+    # Track taken names in memory instead of probing the filesystem per candidate
+    used_names = taken_names(output_path)
+
     print(f"\n📁 Copying files to {output_dir}/...")
 
     for i, att in enumerate(attachments):
@@ -124,10 +131,6 @@ def copy_attachments(attachments, output_dir="imessage_attachments"):
         # Expand home directory path
         source = os.path.expanduser(source)
 
-        if not os.path.exists(source):
-            skipped += 1
-            continue
-
         # Use transfer name or extract from path
         if att['transferName']:
             dest_name = att['transferName']
@@ -135,28 +138,35 @@ def copy_attachments(attachments, output_dir="imessage_attachments"):
             dest_name = os.path.basename(source)
 
         # Ensure unique filename
+        dest_name = unique_name(used_names, dest_name)
         dest_path = output_path / dest_name
-        counter = 1
-        while dest_path.exists():
-            name_parts = dest_name.rsplit('.', 1)
-            if len(name_parts) == 2:
-                dest_name = f"{name_parts[0]}_{counter}.{name_parts[1]}"
-            else:
-                dest_name = f"{dest_name}_{counter}"
-            dest_path = output_path / dest_name
-            counter += 1
 
         try:
-            shutil.copy2(source, dest_path)
+            # Missing sources surface here, saving a separate existence check per file
+            fast_copy(source, dest_path)
+            used_names.add(dest_name.casefold())
             # Note: spread att first, then override filename with the actual destination name
-            copied_files.append({
+            file_info = {
                 **att,
                 'original': source,
                 'copied': str(dest_path),
                 'filename': dest_name,  # Override att['filename'] with actual destination name
-            })
+            }
+            if is_heic(dest_name):
+                # Reserve the JPEG name before its conversion is started, so HEIC files
+                # sharing a stem (IMG_1.heic, IMG_1.heif) never convert onto the same file
+                file_info['jpegName'] = unique_name(used_names, dest_name.rsplit('.', 1)[0] + '.jpg')
+                used_names.add(file_info['jpegName'].casefold())
+        except FileNotFoundError:
+            skipped += 1
+            continue
         except Exception as e:
             errors += 1
+            continue
+
+        copied_files.append(file_info)
+        if on_copied:
+            on_copied(file_info)
 
     print(f"✅ Copied {len(copied_files)} files")
     if skipped:
@@ -166,14 +176,44 @@ def copy_attachments(attachments, output_dir="imessage_attachments"):
 
     return copied_files
 
-def convert_heic_images(copied_files, output_dir="web_ready_images"):
-    """Convert HEIC images to JPEG and copy all images to web_ready_images"""
+def convert_heic_image(file_info, output_path):
+    """Convert one copied HEIC file to JPEG, recording its webPath on success"""
+    jpeg_name = file_info['jpegName']
+    dest_path = output_path / jpeg_name
+
+    if dest_path.exists():
+        file_info['webPath'] = f"web_ready_images/{jpeg_name}"
+        return True
+
+    try:
+        # Use macOS sips command
+        result = subprocess.run(
+            ['sips', '-s', 'format', 'jpeg', file_info['copied'], '--out', str(dest_path)],
+            capture_output=True,
+            timeout=10
+        )
+        if result.returncode == 0:
+            file_info['webPath'] = f"web_ready_images/{jpeg_name}"
+            return True
+    except:
+        pass
+
+    return False
+
+def convert_heic_images(copied_files, output_dir="web_ready_images", conversions=None):
+    """Convert HEIC images to JPEG and copy all images to web_ready_images
+
+    conversions holds futures of HEIC conversions already started while
+    copying; when given, they are awaited instead of converting here.
+    """
 
     output_path = Path(output_dir)
     output_path.mkdir(exist_ok=True)
 
-    heic_files = [f for f in copied_files if f['filename'].lower().endswith(('.heic', '.heif'))]
-    other_images = [f for f in copied_files if not f['filename'].lower().endswith(('.heic', '.heif'))]
+    heic_files = []
+    other_images = []
+    for f in copied_files:
+        (heic_files if is_heic(f['filename']) else other_images).append(f)
 
     print(f"\n🖼️  Processing images for web...")
     print(f"   HEIC files to convert: {len(heic_files)}")
@@ -181,31 +221,13 @@ def convert_heic_images(copied_files, output_dir="web_ready_images"):
 
     # Convert HEIC files
     converted = 0
-    for i, file_info in enumerate(heic_files):
-        if i % 20 == 0 and i > 0:
-            print(f"  Converting HEIC: {i}/{len(heic_files)}")
-
-        source = file_info['copied']
-        jpeg_name = file_info['filename'].rsplit('.', 1)[0] + '.jpg'
-        dest_path = output_path / jpeg_name
-
-        if dest_path.exists():
-            file_info['webPath'] = f"web_ready_images/{jpeg_name}"
-            converted += 1
-            continue
-
-        try:
-            # Use macOS sips command
-            result = subprocess.run(
-                ['sips', '-s', 'format', 'jpeg', source, '--out', str(dest_path)],
-                capture_output=True,
-                timeout=10
-            )
-            if result.returncode == 0:
-                file_info['webPath'] = f"web_ready_images/{jpeg_name}"
-                converted += 1
-        except:
-            pass
+    if conversions is not None:
+        converted = sum(future.result() for future in conversions)
+    else:
+        for i, file_info in enumerate(heic_files):
+            if i % 20 == 0 and i > 0:
+                print(f"  Converting HEIC: {i}/{len(heic_files)}")
+            converted += convert_heic_image(file_info, output_path)
 
     # Copy non-HEIC images to web_ready_images
     copied = 0
@@ -215,7 +237,7 @@ def convert_heic_images(copied_files, output_dir="web_ready_images"):
 
         if not dest_path.exists():
             try:
-                shutil.copy2(source, dest_path)
+                fast_copy(source, dest_path)
                 copied += 1
             except:
                 pass
@@ -235,8 +257,7 @@ def update_json_with_images(image_files, json_file="imessage_data.json"):
     print(f"\n📝 Updating {json_file} with image data...")
 
     # Load existing data
-    with open(json_file, 'r') as f:
-        data = json.load(f)
+    data = read_json(json_file)
 
     # Prepare image data for JSON
     images = []
@@ -244,10 +265,9 @@ def update_json_with_images(image_files, json_file="imessage_data.json"):
         # Use web-accessible path - prefer webPath, then construct from filename
         if 'webPath' in img:
             url = img['webPath']
-        elif img['filename'].lower().endswith(('.heic', '.heif')):
+        elif is_heic(img['filename']):
             # HEIC files should be converted to jpg
-            jpeg_name = img['filename'].rsplit('.', 1)[0] + '.jpg'
-            url = f"web_ready_images/{jpeg_name}"
+            url = f"web_ready_images/{img['jpegName']}"
         else:
             url = f"web_ready_images/{img['filename']}"
 
@@ -268,8 +288,7 @@ def update_json_with_images(image_files, json_file="imessage_data.json"):
         data['statistics']['totalImages'] = len(images)
 
     # Save updated data
-    with open(json_file, 'w') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    write_json(json_file, data)
 
     print(f"✅ Added {len(images)} images to JSON")
 
@@ -288,11 +307,18 @@ def main():
         print("No attachments found")
         return 1
 
-    # Step 2: Copy files locally
-    copied_files = copy_attachments(attachments)
+    # Steps 2-3: Copy files locally, converting each HEIC image as soon as it is copied
+    web_path = Path("web_ready_images")
+    web_path.mkdir(exist_ok=True)
+    conversions = []
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 4) as executor:
+        def start_conversion(file_info):
+            if is_heic(file_info['filename']):
+                conversions.append(executor.submit(convert_heic_image, file_info, web_path))
 
-    # Step 3: Convert HEIC images
-    processed_files = convert_heic_images(copied_files)
+        copied_files = copy_attachments(attachments, on_copied=start_conversion)
+        processed_files = convert_heic_images(copied_files, conversions=conversions)
 
     # Step 4: Update JSON
     image_count = update_json_with_images(processed_files)
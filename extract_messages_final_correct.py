@@ -8,57 +8,35 @@ Now with persistent contact mappings support!
 """
 
 import os
-import sqlite3
-import json
-import re
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
+from attributed_body import decode_attributed_body as decode_attributed_body_correct
+from export_utils import (
+    DIGITS_ONLY, MESSAGE_COLUMNS, MESSAGE_JOINS, PHONE_PUNCT, build_phone_index,
+    connect_read_only, read_json, resolve_contact_name, write_json,
+)
+
 MAPPINGS_FILE = 'contact_mappings.json'
+FETCH_BATCH_SIZE = 10000  # Rows fetched and decoded per batch, a fraction of the query LIMIT
+DECODE_CHUNK_SIZE = 2048  # Blobs per worker task; smaller batches are decoded in-process
 
 def load_contact_mappings():
     """Load persistent contact mappings if available"""
     if os.path.exists(MAPPINGS_FILE):
         try:
-            with open(MAPPINGS_FILE, 'r') as f:
-                mappings = json.load(f)
+            mappings = read_json(MAPPINGS_FILE)
             print(f"📇 Loaded contact mappings: {len(mappings.get('phone_to_name', {}))} phone mappings, {len(mappings.get('group_chats', {}))} group chats")
             return mappings
         except Exception as e:
             print(f"⚠️ Could not load mappings: {e}")
     return {"phone_to_name": {}, "group_chats": {}}
 
-def resolve_contact_name(phone, mappings):
-    """Look up contact name from mappings"""
-    phone_to_name = mappings.get("phone_to_name", {})
-
-    # Direct lookup
-    if phone in phone_to_name:
-        return phone_to_name[phone]
-
-    # Normalized lookup
-    cleaned = re.sub(r'\D', '', str(phone))
-    if len(cleaned) == 10:
-        cleaned = '1' + cleaned
-
-    # Try various formats
-    variants = [
-        cleaned,
-        f"+{cleaned}",
-        f"+1{cleaned[-10:]}" if len(cleaned) >= 10 else None,
-        cleaned[-10:] if len(cleaned) >= 10 else None,
-    ]
-
-    for variant in variants:
-        if variant and variant in phone_to_name:
-            return phone_to_name[variant]
-
-    return None
-
-def get_group_chat_info(chat_identifier, mappings):
-    """Get display name and participants for a group chat"""
-    group_chats = mappings.get("group_chats", {})
-
+def get_group_chat_info(chat_identifier, group_chats):
+    """Get display name and participants for a group chat from the group_chats mappings"""
     if chat_identifier in group_chats:
         info = group_chats[chat_identifier]
         display_name = info.get("display_name") or info.get("resolved_display_name")
@@ -79,7 +57,7 @@ def clean_phone_number(phone):
     if not phone:
         return ""
 
-    cleaned = re.sub(r'\D', '', str(phone))
+    cleaned = str(phone).translate(DIGITS_ONLY)
 
     if len(cleaned) == 10:
         cleaned = '1' + cleaned
@@ -88,131 +66,31 @@ def clean_phone_number(phone):
 
     return f"+{cleaned}" if cleaned else phone
 
-def decode_attributed_body_correct(blob):
-    """
-    Correct decode of NSAttributedString
-    Length byte represents UTF-8 byte count, not character count
-    Handles multi-byte length encoding for messages > 127 bytes
-    """
-    if not blob:
-        return None
+def decode_attributed_bodies(blobs, executor):
+    """Decode attributedBody blobs, spreading large batches across CPU cores"""
+    if len(blobs) < DECODE_CHUNK_SIZE:
+        return [decode_attributed_body_correct(blob) for blob in blobs]
 
-    try:
-        # Look for NSString marker
-        nsstring_pos = blob.find(b'NSString')
-        if nsstring_pos == -1:
-            return None
-
-        # Primary pattern: 67 01 94 84 01 2b [length] [text]
-        patterns = [
-            (bytes([0x67, 0x01, 0x94, 0x84, 0x01, 0x2b]), 0),  # Standard pattern
-            (bytes([0x84, 0x01, 0x2b]), 0),  # Shorter pattern
-            (bytes([0x01, 0x94, 0x84, 0x01, 0x2b]), 0),  # Alternative pattern
-            (bytes([0x01, 0x95, 0x84, 0x01, 0x2b]), 0),  # Another variant
-        ]
-
-        for pattern, length_offset in patterns:
-            pattern_pos = blob.find(pattern, nsstring_pos)
-            if pattern_pos != -1:
-                # Length byte position
-                length_pos = pattern_pos + len(pattern) + length_offset
-
-                if length_pos < len(blob):
-                    length_byte = blob[length_pos]
-
-                    # Handle multi-byte length encoding
-                    # If high bit is set (>= 0x80), lower bits indicate how many bytes follow
-                    if length_byte >= 0x80:
-                        # Multi-byte length: lower 7 bits = number of following length bytes
-                        num_length_bytes = length_byte & 0x7F
-                        if num_length_bytes == 1 and length_pos + 2 < len(blob):
-                            # Single additional byte for length, plus null separator
-                            text_length = blob[length_pos + 1]
-                            # Skip: 0x81 + length_byte + 0x00 separator
-                            text_start = length_pos + 3
-                        elif num_length_bytes == 2 and length_pos + 3 < len(blob):
-                            # Two additional bytes for length (little-endian), plus null separator
-                            text_length = blob[length_pos + 1] | (blob[length_pos + 2] << 8)
-                            text_start = length_pos + 4
-                        else:
-                            continue
-                    else:
-                        # Single byte length (< 128)
-                        text_length = length_byte
-                        text_start = length_pos + 1
-
-                    # Validate and extract
-                    if 1 <= text_length <= 10000 and text_start + text_length <= len(blob):
-                        try:
-                            text_bytes = blob[text_start:text_start + text_length]
-                            text = text_bytes.decode('utf-8', errors='strict')
-
-                            # Clean control characters
-                            clean_text = ''
-                            for char in text:
-                                if ord(char) >= 32 or char in '\n\t\r':
-                                    clean_text += char
-                                elif ord(char) < 32:
-                                    break
-
-                            clean_text = clean_text.strip()
-
-                            if len(clean_text) > 0:
-                                return clean_text
-
-                        except UnicodeDecodeError:
-                            continue
-
-        # Fallback: scan for length + valid UTF-8 sequences
-        # Start searching after NSString
-        search_start = nsstring_pos + 8
-
-        for i in range(search_start, min(search_start + 100, len(blob) - 10)):
-            potential_length = blob[i]
-
-            # Try reasonable lengths
-            if 2 <= potential_length <= 200:
-                text_start = i + 1
-                if text_start + potential_length <= len(blob):
-                    try:
-                        # Extract the exact number of bytes
-                        text_bytes = blob[text_start:text_start + potential_length]
-
-                        # Try to decode as UTF-8
-                        text = text_bytes.decode('utf-8', errors='strict')
-
-                        # Validate it looks like a message
-                        if (any(c.isalnum() for c in text) and
-                            not text.startswith('NS') and
-                            not text.startswith('__')):
-
-                            # Clean control chars
-                            clean_text = ''
-                            for char in text:
-                                if ord(char) >= 32 or char in '\n\t\r':
-                                    clean_text += char
-                                elif ord(char) < 32:
-                                    break
-
-                            clean_text = clean_text.strip()
-
-                            if len(clean_text) >= 2:
-                                return clean_text
-
-                    except UnicodeDecodeError:
-                        # Not valid UTF-8 at this position
-                        continue
-
-    except Exception as e:
-        pass
+    return list(executor.map(decode_attributed_body_correct, blobs, chunksize=DECODE_CHUNK_SIZE))
 
-    return None
+def iter_decoded_rows(cursor):
+    """Stream rows from cursor a batch at a time, each paired with its decoded attributedBody"""
+    with ProcessPoolExecutor() as executor:
+        for rows in iter(cursor.fetchmany, []):
+            # Decode the batch's attributedBody-only messages together, in parallel
+            decoded = iter(decode_attributed_bodies(
+                [row[2] for row in rows if not row[1] and row[2]], executor))
+            for row in rows:
+                yield row, (next(decoded) if not row[1] and row[2] else None)
 
 def extract_all_messages():
     """Extract ALL messages with correct UTF-8 byte handling"""
 
     # Load persistent contact mappings
     mappings = load_contact_mappings()
+    phone_to_name = mappings.get("phone_to_name", {})
+    phone_index = build_phone_index(phone_to_name)
+    group_chats = mappings.get("group_chats", {})
 
     db_path = find_chat_db()
     if not db_path:
@@ -221,88 +99,73 @@ def extract_all_messages():
 
     print(f"Found database: {db_path}")
 
-    conn = sqlite3.connect(db_path)
+    conn = connect_read_only(db_path)
     cursor = conn.cursor()
 
     print("Extracting messages with correct UTF-8 byte handling...")
 
     # Query for ALL messages
-    query = """
-    SELECT DISTINCT
-        m.ROWID as message_id,
-        m.text as message_text,
-        m.attributedBody as attributed_body,
-        m.is_from_me,
-        datetime(m.date / 1000000000 + strftime('%s', '2001-01-01'), 'unixepoch', 'localtime') as message_date,
-        h.id as contact_identifier,
-        c.chat_identifier,
-        c.display_name as chat_display_name,
-        m.service
-    FROM message m
-    LEFT JOIN chat_message_join cmj ON m.ROWID = cmj.message_id
-    LEFT JOIN chat c ON cmj.chat_id = c.ROWID
-    LEFT JOIN handle h ON m.handle_id = h.ROWID
+    query = f"""
+    SELECT {MESSAGE_COLUMNS},
+        c.chat_identifier GLOB 'chat*' as is_group_chat,
+        CASE
+            WHEN c.chat_identifier GLOB 'chat*' THEN c.chat_identifier
+            ELSE COALESCE(NULLIF(h.id, ''), NULLIF(c.chat_identifier, ''), 'unknown_' || m.ROWID)
+        END as contact_key
+    {MESSAGE_JOINS}
     ORDER BY m.date DESC
     LIMIT 50000
     """
 
+    # Stream rows in batches instead of materializing every row at once
+    cursor.arraysize = FETCH_BATCH_SIZE
     cursor.execute(query)
-    results = cursor.fetchall()
-
-    print(f"Found {len(results)} total messages")
 
     # Process messages
+    total_messages = 0
     contacts = {}
     messages = []
+    message_keys = []  # contact_key of each message, counted once after the loop
+    # Dates and their hours are collected alongside the messages so the statistics pass stays numeric
+    dates = []
+    hours = array('B')
     contact_id_counter = 1
     messages_with_text = 0
     messages_from_attributed = 0
     extraction_errors = 0
 
-    for row in results:
-        message_id, text, attributed_body, is_from_me, date, contact_identifier, chat_identifier, chat_display_name, service = row
+    for row, extracted_text in iter_decoded_rows(cursor):
+        total_messages += 1
+        message_id, text, attributed_body, is_from_me, date, contact_identifier, chat_identifier, chat_display_name, service, is_group_chat, contact_key = row
 
         # Extract message content
         message_content = text
 
         if not message_content and attributed_body:
-            # Use our correct UTF-8 aware decoder
-            try:
-                extracted_text = decode_attributed_body_correct(attributed_body)
-                if extracted_text:
-                    message_content = extracted_text
-                    messages_from_attributed += 1
-                else:
-                    extraction_errors += 1
-            except Exception as e:
+            # Decoded by our correct UTF-8 aware decoder
+            if extracted_text:
+                message_content = extracted_text
+                messages_from_attributed += 1
+            else:
                 extraction_errors += 1
 
         if message_content:
             messages_with_text += 1
 
-            # Determine contact - for group chats, always use chat_identifier to keep messages together
-            is_group_chat = chat_identifier and chat_identifier.startswith('chat')
-
-            if is_group_chat:
-                # Group chat: use chat_identifier to keep all messages together
-                contact_key = chat_identifier
-            elif contact_identifier:
-                # Individual chat: use contact identifier
-                contact_key = contact_identifier
-            elif chat_identifier:
-                contact_key = chat_identifier
-            else:
-                contact_key = f"unknown_{message_id}"
+            # contact_key and is_group_chat come from the query: group chats are keyed by
+            # chat_identifier to keep messages together, individual chats by contact identifier
+            is_group_chat = bool(is_group_chat)
 
             # Create or update contact
-            if contact_key not in contacts:
+            contact = contacts.get(contact_key)
+            if contact is None:
                 name = contact_key
                 display_name = None
                 participants = []
 
                 if is_group_chat:
                     # Try to get group chat info from mappings
-                    mapped_display_name, participants = get_group_chat_info(chat_identifier, mappings)
+                    mapped_display_name, participants = get_group_chat_info(chat_identifier, group_chats)
                     if chat_display_name:
                         name = chat_display_name
                     elif mapped_display_name:
@@ -310,13 +173,13 @@ def extract_all_messages():
                         name = chat_identifier  # Keep original as name, display_name for UI
                 else:
                     # Individual chat - try to resolve from mappings first
-                    resolved_name = resolve_contact_name(contact_identifier, mappings)
+                    resolved_name = resolve_contact_name(contact_identifier, phone_to_name, phone_index)
                     if resolved_name:
                         name = resolved_name
                     elif chat_display_name:
                         name = chat_display_name
                     elif contact_identifier:
-                        if contact_identifier.startswith('+') or contact_identifier.replace('-', '').replace('(', '').replace(')', '').replace(' ', '').isdigit():
+                        if contact_identifier.startswith('+') or contact_identifier.translate(PHONE_PUNCT).isdigit():
                             name = clean_phone_number(contact_identifier)
                         else:
                             name = contact_identifier
@@ -335,22 +198,37 @@ def extract_all_messages():
                 if participants:
                     contact_data['participants'] = participants
 
-                contacts[contact_key] = contact_data
+                contact = contacts[contact_key] = contact_data
                 contact_id_counter += 1
 
             # Add message
-            contacts[contact_key]['messageCount'] += 1
+            message_keys.append(contact_key)
 
             messages.append({
                 'id': message_id,
-                'contactId': contacts[contact_key]['id'],
+                'contactId': contact['id'],
                 'content': message_content,
                 'date': date,
                 'isFromMe': bool(is_from_me)
             })
 
+            # Dates are always "YYYY-MM-DD HH:MM:SS" from SQLite, so the hour is a fixed slice
+            if date:
+                dates.append(date)
+                try:
+                    hour = int(date[11:13])
+                except ValueError:
+                    hour = -1
+                if 0 <= hour < 24:
+                    hours.append(hour)
+
     conn.close()
 
+    # Count messages per contact in one C-level pass instead of an increment per message
+    for contact_key, count in Counter(message_keys).items():
+        contacts[contact_key]['messageCount'] = count
+
+    print(f"Found {total_messages} total messages")
     print(f"✅ Extracted {messages_with_text} messages with content")
     print(f"  - {messages_with_text - messages_from_attributed} from text field")
     print(f"  - {messages_from_attributed} from attributedBody field")
@@ -362,7 +240,7 @@ def extract_all_messages():
     contacts_list.sort(key=lambda x: x['messageCount'], reverse=True)
 
     # Calculate statistics
-    stats = calculate_statistics(messages, contacts_list)
+    stats = calculate_statistics(messages, contacts_list, dates, hours)
 
     # Prepare final data
     data = {
@@ -374,31 +252,36 @@ def extract_all_messages():
 
     return data
 
-def calculate_statistics(messages, contacts):
-    """Calculate message statistics"""
+def calculate_statistics(messages, contacts, dates, hours):
+    """Calculate message statistics from the messages and their collected dates and hours"""
     total_messages = len(messages)
-    messages_sent = sum(1 for m in messages if m['isFromMe'])
-    messages_received = total_messages - messages_sent
 
-    # Calculate hourly distribution
-    hourly_dist = [0] * 24
+    # Count each hour with a C-level scan of the byte array instead of a Python increment per message
+    hourly_dist = [hours.count(hour) for hour in range(24)]
+
+    # Gather the remaining statistics in a single pass over the messages
+    messages_sent = 0
+    total_length = 0
+    with_content = 0
     for message in messages:
-        try:
-            hour = datetime.fromisoformat(message['date']).hour
-            hourly_dist[hour] += 1
-        except:
-            pass
+        if message['isFromMe']:
+            messages_sent += 1
+
+        content = message['content']
+        if content:
+            total_length += len(content)
+            with_content += 1
+
+    messages_received = total_messages - messages_sent
 
     # Date range
-    dates = [m['date'] for m in messages if m['date']]
     date_range = {
         'start': min(dates) if dates else '',
         'end': max(dates) if dates else ''
     }
 
     # Average message length
-    lengths = [len(m['content']) for m in messages if m['content']]
-    avg_length = sum(lengths) / len(lengths) if lengths else 0
+    avg_length = total_length / with_content if with_content else 0
 
     return {
         'totalMessages': total_messages,
@@ -428,15 +311,13 @@ def main():
     output_file = 'imessage_data.json'
     backup_file = f'imessage_data_backup_{int(datetime.now().timestamp())}.json'
 
-    # Backup existing file
+    # Backup existing file by renaming it; the new data is written in its place below
     if Path(output_file).exists():
-        import shutil
-        shutil.copy2(output_file, backup_file)
+        os.replace(output_file, backup_file)
         print(f"📦 Backed up existing data to {backup_file}")
 
-    # Save new data
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    # Save new data compactly; orjson encodes it much faster when installed
+    write_json(output_file, data)
 
     print(f"\n✅ Data saved to {output_file}")
 
@@ -15,15 +15,20 @@ Usage:
 
 import os
 import sys
-import json
-import sqlite3
-import shutil
-import subprocess
 import argparse
-import re
 from pathlib import Path
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from contextlib import contextmanager
+# subprocess and concurrent.futures are imported where they are used,
+# so quick commands such as --update only pay for the modules they need
+
+from attributed_body import decode_attributed_body
+from export_utils import (
+    DIGITS_ONLY, MESSAGE_COLUMNS, MESSAGE_JOINS, PHONE_PUNCT, build_phone_index,
+    connect_read_only, fast_copy, lookup_contacts_via_applescript, read_json,
+    resolve_contact_name, taken_names, unique_name, write_json,
+)
 
 # ============================================================================
 # Configuration
@@ -51,7 +56,7 @@ def clean_phone_number(phone):
     """Clean and normalize phone number"""
     if not phone:
         return ""
-    cleaned = re.sub(r'\D', '', str(phone))
+    cleaned = str(phone).translate(DIGITS_ONLY)
     if len(cleaned) == 10:
         cleaned = '1' + cleaned
     elif len(cleaned) == 11 and cleaned.startswith('1'):
@@ -62,166 +67,51 @@ def load_mappings():
     """Load persistent contact mappings"""
     if os.path.exists(MAPPINGS_FILE):
         try:
-            with open(MAPPINGS_FILE, 'r') as f:
-                return json.load(f)
+            return read_json(MAPPINGS_FILE)
         except:
             pass
     return {"version": 1, "phone_to_name": {}, "group_chats": {}}
 
 def save_mappings(mappings):
     """Save contact mappings"""
-    with open(MAPPINGS_FILE, 'w') as f:
-        json.dump(mappings, f, indent=2)
+    # Write a temporary file and swap it in, so an interrupted save never truncates the mappings
+    tmp_file = MAPPINGS_FILE + '.tmp'
+    write_json(tmp_file, mappings, pretty=True)
+    os.replace(tmp_file, MAPPINGS_FILE)
+
+@contextmanager
+def mappings_transaction():
+    """Load contact mappings and save them once when the block completes"""
+    mappings = load_mappings()
+    yield mappings
+    save_mappings(mappings)
 
 def load_data():
     """Load existing data file"""
     if os.path.exists(DATA_FILE):
         try:
-            with open(DATA_FILE, 'r') as f:
-                return json.load(f)
+            return read_json(DATA_FILE)
         except:
             pass
     return None
 
 def save_data(data):
     """Save data with backup"""
-    # Backup existing file
+    # Backup existing file by renaming it; the new data is written in its place below
     if os.path.exists(DATA_FILE):
         backup = f"imessage_data_backup_{int(datetime.now().timestamp())}.json"
-        shutil.copy2(DATA_FILE, backup)
+        os.replace(DATA_FILE, backup)
         print(f"  📦 Backed up to {backup}")
 
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-
-# ============================================================================
-# Message Decoding
-# ============================================================================
-
-def decode_attributed_body(blob):
-    """Decode NSAttributedString with proper UTF-8 byte handling"""
-    if not blob:
-        return None
-
-    try:
-        nsstring_pos = blob.find(b'NSString')
-        if nsstring_pos == -1:
-            return None
-
-        patterns = [
-            (bytes([0x67, 0x01, 0x94, 0x84, 0x01, 0x2b]), 0),
-            (bytes([0x84, 0x01, 0x2b]), 0),
-            (bytes([0x01, 0x94, 0x84, 0x01, 0x2b]), 0),
-            (bytes([0x01, 0x95, 0x84, 0x01, 0x2b]), 0),
-        ]
-
-        for pattern, length_offset in patterns:
-            pattern_pos = blob.find(pattern, nsstring_pos)
-            if pattern_pos != -1:
-                length_pos = pattern_pos + len(pattern) + length_offset
-
-                if length_pos < len(blob):
-                    length_byte = blob[length_pos]
-
-                    if length_byte >= 0x80:
-                        num_length_bytes = length_byte & 0x7F
-                        if num_length_bytes == 1 and length_pos + 2 < len(blob):
-                            text_length = blob[length_pos + 1]
-                            text_start = length_pos + 3
-                        elif num_length_bytes == 2 and length_pos + 3 < len(blob):
-                            text_length = blob[length_pos + 1] | (blob[length_pos + 2] << 8)
-                            text_start = length_pos + 4
-                        else:
-                            continue
-                    else:
-                        text_length = length_byte
-                        text_start = length_pos + 1
-
-                    if 1 <= text_length <= 10000 and text_start + text_length <= len(blob):
-                        try:
-                            text_bytes = blob[text_start:text_start + text_length]
-                            text = text_bytes.decode('utf-8', errors='strict')
-
-                            clean_text = ''
-                            for char in text:
-                                if ord(char) >= 32 or char in '\n\t\r':
-                                    clean_text += char
-                                elif ord(char) < 32:
-                                    break
-
-                            clean_text = clean_text.strip()
-                            if len(clean_text) > 0:
-                                return clean_text
-
-                        except UnicodeDecodeError:
-                            continue
-
-        # Fallback scan
-        search_start = nsstring_pos + 8
-        for i in range(search_start, min(search_start + 100, len(blob) - 10)):
-            potential_length = blob[i]
-            if 2 <= potential_length <= 200:
-                text_start = i + 1
-                if text_start + potential_length <= len(blob):
-                    try:
-                        text_bytes = blob[text_start:text_start + potential_length]
-                        text = text_bytes.decode('utf-8', errors='strict')
-
-                        if (any(c.isalnum() for c in text) and
-                            not text.startswith('NS') and
-                            not text.startswith('__')):
-
-                            clean_text = ''
-                            for char in text:
-                                if ord(char) >= 32 or char in '\n\t\r':
-                                    clean_text += char
-                                elif ord(char) < 32:
-                                    break
-
-                            clean_text = clean_text.strip()
-                            if len(clean_text) >= 2:
-                                return clean_text
-
-                    except UnicodeDecodeError:
-                        continue
-
-    except Exception:
-        pass
-
-    return None
+    # Compact output; orjson encodes it much faster when installed
+    write_json(DATA_FILE, data)
 
 # ============================================================================
 # Contact Resolution
 # ============================================================================
 
-def resolve_contact_name(phone, mappings):
-    """Look up contact name from mappings"""
-    phone_to_name = mappings.get("phone_to_name", {})
-
-    if phone in phone_to_name:
-        return phone_to_name[phone]
-
-    cleaned = re.sub(r'\D', '', str(phone))
-    if len(cleaned) == 10:
-        cleaned = '1' + cleaned
-
-    variants = [
-        cleaned,
-        f"+{cleaned}",
-        f"+1{cleaned[-10:]}" if len(cleaned) >= 10 else None,
-        cleaned[-10:] if len(cleaned) >= 10 else None,
-    ]
-
-    for variant in variants:
-        if variant and variant in phone_to_name:
-            return phone_to_name[variant]
-
-    return None
-
-def get_group_chat_info(chat_identifier, mappings):
-    """Get display name and participants for a group chat"""
-    group_chats = mappings.get("group_chats", {})
-
+def get_group_chat_info(chat_identifier, group_chats):
+    """Get display name and participants for a group chat from the group_chats mappings"""
     if chat_identifier in group_chats:
         info = group_chats[chat_identifier]
         display_name = info.get("display_name") or info.get("resolved_display_name")
@@ -234,29 +124,26 @@ def query_group_chat_participants(cursor):
     """Query group chat participants from database"""
     group_chats = {}
 
+    # One join for every chat and participant instead of a participant query per chat
     cursor.execute("""
-        SELECT ROWID, chat_identifier, display_name
-        FROM chat
-        WHERE chat_identifier LIKE 'chat%'
+        SELECT c.ROWID, c.chat_identifier, c.display_name, h.id
+        FROM chat c
+        JOIN chat_handle_join chj ON chj.chat_id = c.ROWID
+        JOIN handle h ON h.ROWID = chj.handle_id
+        WHERE c.chat_identifier LIKE 'chat%'
+        ORDER BY c.ROWID
     """)
 
-    chats = cursor.fetchall()
-
-    for chat_rowid, chat_id, display_name in chats:
-        cursor.execute("""
-            SELECT h.id
-            FROM handle h
-            JOIN chat_handle_join chj ON h.ROWID = chj.handle_id
-            WHERE chj.chat_id = ?
-        """, (chat_rowid,))
-
-        participants = [row[0] for row in cursor.fetchall()]
-
-        if participants:
+    current_rowid = None
+    for chat_rowid, chat_id, display_name, handle_id in cursor:
+        if chat_rowid != current_rowid:
+            current_rowid = chat_rowid
+            participants = []
             group_chats[chat_id] = {
                 "display_name": display_name or "",
                 "participants": participants
             }
+        participants.append(handle_id)
 
     return group_chats
 
@@ -271,7 +158,7 @@ def resolve_participant_names(group_chats, phone_to_name):
             name = phone_to_name.get(participant)
 
             if not name:
-                cleaned = re.sub(r'\D', '', str(participant))
+                cleaned = str(participant).translate(DIGITS_ONLY)
                 if len(cleaned) == 10:
                     cleaned = '1' + cleaned
                 name = phone_to_name.get(cleaned) or phone_to_name.get(f"+{cleaned}")
@@ -288,60 +175,18 @@ def resolve_participant_names(group_chats, phone_to_name):
 
 def resolve_contacts_via_applescript(phones_to_resolve, limit=50):
     """Resolve contacts using AppleScript (slower but more accurate)"""
-    resolved = {}
-
-    for i, phone in enumerate(phones_to_resolve[:limit]):
-        if i % 10 == 0 and i > 0:
-            print(f"    Resolving contacts: {i}/{min(len(phones_to_resolve), limit)}")
-
-        try:
-            script = f'''
-            on run
-                tell application "Contacts"
-                    set foundPeople to {{}}
-                    try
-                        set foundPeople to foundPeople & (every person whose value of every phone contains "{phone}")
-                    end try
-                    try
-                        set foundPeople to foundPeople & (every person whose value of every email contains "{phone}")
-                    end try
-                    if (count of foundPeople) > 0 then
-                        set thePerson to item 1 of foundPeople
-                        set firstName to first name of thePerson
-                        set lastName to last name of thePerson
-                        if firstName is missing value then set firstName to ""
-                        if lastName is missing value then set lastName to ""
-                        if firstName is not "" and lastName is not "" then
-                            return firstName & " " & lastName
-                        else if firstName is not "" then
-                            return firstName
-                        else if lastName is not "" then
-                            return lastName
-                        else
-                            return ""
-                        end if
-                    else
-                        return ""
-                    end if
-                end tell
-            end run
-            '''
-
-            result = subprocess.run(['osascript', '-e', script],
-                                  capture_output=True, text=True, timeout=5)
-
-            if result.returncode == 0 and result.stdout.strip():
-                resolved[phone] = result.stdout.strip()
-        except:
-            pass
-
-    return resolved
+    phones = phones_to_resolve[:limit]
+    if not phones:
+        return {}
 
+    print(f"    Resolving {len(phones)} contacts in one AppleScript call...")
+    return lookup_contacts_via_applescript(phones)
 
 def resolve_unresolved_contacts(data, mappings, limit=100):
-    """Find and resolve unresolved contacts via AppleScript"""
+    """Find and resolve unresolved contacts via AppleScript, updating mappings without saving them"""
     # Find contacts that still show as phone numbers or emails
     unresolved = []
+    seen = set()  # Constant-time duplicate check; the list keeps the original order
     for contact in data.get('contacts', []):
         if contact.get('isGroupChat'):
             continue
@@ -349,7 +194,8 @@ def resolve_unresolved_contacts(data, mappings, limit=100):
         phone = contact.get('phone', '')
         # Check if name is unresolved (phone number, email, or chat ID)
         if name.startswith('+') or '@' in name or name.startswith('chat'):
-            if phone and phone not in unresolved:
+            if phone and phone not in seen:
+                seen.add(phone)
                 unresolved.append(phone)
 
     if not unresolved:
@@ -367,12 +213,15 @@ def resolve_unresolved_contacts(data, mappings, limit=100):
     # Update mappings
     for phone, name in resolved.items():
         mappings['phone_to_name'][phone] = name
-        cleaned = re.sub(r'\D', '', phone)
+        cleaned = phone.translate(DIGITS_ONLY)
         if cleaned:
             mappings['phone_to_name'][cleaned] = name
             mappings['phone_to_name'][f"+{cleaned}"] = name
 
-    save_mappings(mappings)
+    # Index resolved names by normalized phone once; the first resolved phone wins, as before
+    resolved_by_digits = {}
+    for orig_phone, name in resolved.items():
+        resolved_by_digits.setdefault(orig_phone.translate(DIGITS_ONLY), name)
 
     # Update contact names in data
     updated = 0
@@ -383,12 +232,10 @@ def resolve_unresolved_contacts(data, mappings, limit=100):
             updated += 1
         else:
             # Try normalized phone
-            cleaned = re.sub(r'\D', '', phone)
-            for orig_phone, name in resolved.items():
-                if re.sub(r'\D', '', orig_phone) == cleaned:
-                    contact['name'] = name
-                    updated += 1
-                    break
+            name = resolved_by_digits.get(phone.translate(DIGITS_ONLY))
+            if name is not None:
+                contact['name'] = name
+                updated += 1
 
     print(f"  ✅ Resolved {len(resolved)} contacts, updated {updated} in data")
     return len(resolved)
@@ -398,58 +245,52 @@ def resolve_unresolved_contacts(data, mappings, limit=100):
 # Message Extraction
 # ============================================================================
 
-def extract_messages(mappings, limit=MESSAGE_LIMIT, since_date=None):
+def extract_messages(mappings, limit=MESSAGE_LIMIT, since_rowid=None):
     """Extract messages from iMessage database"""
     db_path = find_chat_db()
     if not db_path:
         print("❌ No iMessage database found")
         return None
 
-    conn = sqlite3.connect(db_path)
+    phone_to_name = mappings.get("phone_to_name", {})
+    phone_index = build_phone_index(phone_to_name)
+    group_chats = mappings.get("group_chats", {})
+
+    conn = connect_read_only(db_path)
     cursor = conn.cursor()
 
     # Build query
-    date_filter = ""
+    rowid_filter = ""
+    order_by = "m.date DESC"
     params = [limit]
 
-    if since_date:
-        # Convert datetime to Apple's epoch
-        apple_epoch = (since_date - datetime(2001, 1, 1)).total_seconds() * 1000000000
-        date_filter = "AND m.date > ?"
-        params = [apple_epoch, limit]
+    if since_rowid:
+        # ROWIDs only grow, so new messages are exactly those above the last one seen,
+        # and walking the primary key backward reads nothing older than that
+        rowid_filter = "AND m.ROWID > ?"
+        order_by = "m.ROWID DESC"
+        params = [since_rowid, limit]
 
     query = f"""
-    SELECT DISTINCT
-        m.ROWID as message_id,
-        m.text as message_text,
-        m.attributedBody as attributed_body,
-        m.is_from_me,
-        datetime(m.date / 1000000000 + strftime('%s', '2001-01-01'), 'unixepoch', 'localtime') as message_date,
-        h.id as contact_identifier,
-        c.chat_identifier,
-        c.display_name as chat_display_name,
-        m.service
-    FROM message m
-    LEFT JOIN chat_message_join cmj ON m.ROWID = cmj.message_id
-    LEFT JOIN chat c ON cmj.chat_id = c.ROWID
-    LEFT JOIN handle h ON m.handle_id = h.ROWID
-    WHERE 1=1 {date_filter}
-    ORDER BY m.date DESC
+    SELECT {MESSAGE_COLUMNS}
+    {MESSAGE_JOINS}
+    WHERE 1=1 {rowid_filter}
+    ORDER BY {order_by}
     LIMIT ?
     """
 
     cursor.execute(query, params)
-    results = cursor.fetchall()
 
-    print(f"  Found {len(results)} messages")
-
-    # Process messages
+    # Process messages as the cursor yields them instead of materializing every row first
+    total_messages = 0
     contacts = {}
     messages = []
+    message_keys = []  # contact_key of each message, counted once after the loop
     contact_id_counter = 1
     messages_with_text = 0
 
-    for row in results:
+    for row in cursor:
+        total_messages += 1
         message_id, text, attributed_body, is_from_me, date, contact_identifier, chat_identifier, chat_display_name, service = row
 
         # Extract message content
@@ -473,26 +314,27 @@ def extract_messages(mappings, limit=MESSAGE_LIMIT, since_date=None):
                 contact_key = f"unknown_{message_id}"
 
             # Create or update contact
-            if contact_key not in contacts:
+            contact = contacts.get(contact_key)
+            if contact is None:
                 name = contact_key
                 display_name = None
                 participants = []
 
                 if is_group_chat:
-                    mapped_display_name, participants = get_group_chat_info(chat_identifier, mappings)
+                    mapped_display_name, participants = get_group_chat_info(chat_identifier, group_chats)
                     if chat_display_name:
                         name = chat_display_name
                     elif mapped_display_name:
                         display_name = mapped_display_name
                         name = chat_identifier
                 else:
-                    resolved_name = resolve_contact_name(contact_identifier, mappings)
+                    resolved_name = resolve_contact_name(contact_identifier, phone_to_name, phone_index)
                     if resolved_name:
                         name = resolved_name
                     elif chat_display_name:
                         name = chat_display_name
                     elif contact_identifier:
-                        if contact_identifier.startswith('+') or contact_identifier.replace('-', '').replace('(', '').replace(')', '').replace(' ', '').isdigit():
+                        if contact_identifier.startswith('+') or contact_identifier.translate(PHONE_PUNCT).isdigit():
                             name = clean_phone_number(contact_identifier)
                         else:
                             name = contact_identifier
@@ -510,14 +352,14 @@ def extract_messages(mappings, limit=MESSAGE_LIMIT, since_date=None):
                 if participants:
                     contact_data['participants'] = participants
 
-                contacts[contact_key] = contact_data
+                contact = contacts[contact_key] = contact_data
                 contact_id_counter += 1
 
-            contacts[contact_key]['messageCount'] += 1
+            message_keys.append(contact_key)
 
             messages.append({
                 'id': message_id,
-                'contactId': contacts[contact_key]['id'],
+                'contactId': contact['id'],
                 'content': message_content,
                 'date': date,
                 'isFromMe': bool(is_from_me)
@@ -525,6 +367,11 @@ def extract_messages(mappings, limit=MESSAGE_LIMIT, since_date=None):
 
     conn.close()
 
+    # Count messages per contact in one C-level pass instead of an increment per message
+    for contact_key, count in Counter(message_keys).items():
+        contacts[contact_key]['messageCount'] = count
+
+    print(f"  Found {total_messages} messages")
     print(f"  ✅ Extracted {messages_with_text} messages with content")
 
     # Calculate statistics
@@ -543,25 +390,42 @@ def extract_messages(mappings, limit=MESSAGE_LIMIT, since_date=None):
 def calculate_statistics(messages, contacts):
     """Calculate message statistics"""
     total_messages = len(messages)
-    messages_sent = sum(1 for m in messages if m['isFromMe'])
-    messages_received = total_messages - messages_sent
 
+    # Gather every statistic in a single pass over the messages
+    messages_sent = 0
     hourly_dist = [0] * 24
+    start_date = end_date = None
+    total_length = 0
+    with_content = 0
     for message in messages:
-        try:
-            hour = datetime.fromisoformat(message['date']).hour
-            hourly_dist[hour] += 1
-        except:
-            pass
+        if message['isFromMe']:
+            messages_sent += 1
+
+        # Dates are ISO formatted, so string comparison orders them chronologically
+        date = message['date']
+        if date:
+            try:
+                hourly_dist[datetime.fromisoformat(date).hour] += 1
+            except:
+                pass
+            if start_date is None or date < start_date:
+                start_date = date
+            if end_date is None or date > end_date:
+                end_date = date
+
+        content = message['content']
+        if content:
+            total_length += len(content)
+            with_content += 1
+
+    messages_received = total_messages - messages_sent
 
-    dates = [m['date'] for m in messages if m['date']]
     date_range = {
-        'start': min(dates) if dates else '',
-        'end': max(dates) if dates else ''
+        'start': start_date or '',
+        'end': end_date or ''
     }
 
-    lengths = [len(m['content']) for m in messages if m['content']]
-    avg_length = sum(lengths) / len(lengths) if lengths else 0
+    avg_length = total_length / with_content if with_content else 0
 
     return {
         'totalMessages': total_messages,
@@ -583,7 +447,7 @@ def extract_attachments(limit=ATTACHMENT_LIMIT):
     if not db_path:
         return []
 
-    conn = sqlite3.connect(db_path)
+    conn = connect_read_only(db_path)
     cursor = conn.cursor()
 
     query = """
@@ -641,6 +505,19 @@ def extract_attachments(limit=ATTACHMENT_LIMIT):
 
     return attachments
 
+def convert_heic_to_jpeg(task):
+    """Convert one (source, destination) HEIC file to JPEG with sips, returning True on success"""
+    import subprocess
+    source, dest = task
+    try:
+        result = subprocess.run(
+            ['sips', '-s', 'format', 'jpeg', str(source), '--out', str(dest)],
+            capture_output=True, timeout=10
+        )
+        return result.returncode == 0
+    except:
+        return False
+
 def copy_and_convert_attachments(attachments, mappings):
     """Copy attachments and convert HEIC to JPEG"""
     output_path = Path(ATTACHMENTS_DIR)
@@ -649,7 +526,13 @@ def copy_and_convert_attachments(attachments, mappings):
     web_path = Path(WEB_IMAGES_DIR)
     web_path.mkdir(exist_ok=True)
 
+    phone_to_name = mappings.get("phone_to_name", {})
+    phone_index = build_phone_index(phone_to_name)
+
     processed = []
+    heic_tasks = []  # (source, destination) pairs, converted in parallel after copying
+    # Track taken names in memory instead of probing the filesystem per candidate
+    used_names = taken_names(output_path)
     copied = 0
     converted = 0
     skipped = 0
@@ -673,21 +556,13 @@ def copy_and_convert_attachments(attachments, mappings):
         # Determine destination filename
         dest_name = att['transferName'] or os.path.basename(source)
 
-        # Copy to attachments dir
+        # Copy to attachments dir, picking a free name from the in-memory set
+        dest_name = unique_name(used_names, dest_name)
         dest_path = output_path / dest_name
-        counter = 1
-        base_name = dest_name
-        while dest_path.exists():
-            name_parts = base_name.rsplit('.', 1)
-            if len(name_parts) == 2:
-                dest_name = f"{name_parts[0]}_{counter}.{name_parts[1]}"
-            else:
-                dest_name = f"{base_name}_{counter}"
-            dest_path = output_path / dest_name
-            counter += 1
 
         try:
-            shutil.copy2(source, dest_path)
+            fast_copy(source, dest_path)
+            used_names.add(dest_name.casefold())
             copied += 1
         except:
             skipped += 1
@@ -695,19 +570,13 @@ def copy_and_convert_attachments(attachments, mappings):
 
         # Convert to web-ready format
         if dest_name.lower().endswith(('.heic', '.heif')):
-            jpeg_name = dest_name.rsplit('.', 1)[0] + '.jpg'
+            # Reserve the JPEG name now, so HEIC files sharing a stem never convert onto the same file
+            jpeg_name = unique_name(used_names, dest_name.rsplit('.', 1)[0] + '.jpg')
+            used_names.add(jpeg_name.casefold())
             web_dest = web_path / jpeg_name
 
             if not web_dest.exists():
-                try:
-                    result = subprocess.run(
-                        ['sips', '-s', 'format', 'jpeg', str(dest_path), '--out', str(web_dest)],
-                        capture_output=True, timeout=10
-                    )
-                    if result.returncode == 0:
-                        converted += 1
-                except:
-                    pass
+                heic_tasks.append((dest_path, web_dest))
 
             url = f"{WEB_IMAGES_DIR}/{jpeg_name}"
         else:
@@ -715,14 +584,15 @@ def copy_and_convert_attachments(attachments, mappings):
             web_dest = web_path / dest_name
             if not web_dest.exists():
                 try:
-                    shutil.copy2(dest_path, web_dest)
+                    # Cloned on APFS, so the web copy shares the attachment's blocks instead of rewriting them
+                    fast_copy(dest_path, web_dest)
                 except:
                     pass
             url = f"{WEB_IMAGES_DIR}/{dest_name}"
 
         # Resolve contact name from mappings
         contact_name = att['contactName']
-        resolved = resolve_contact_name(att['contactId'], mappings)
+        resolved = resolve_contact_name(att['contactId'], phone_to_name, phone_index)
         if resolved:
             contact_name = resolved
 
@@ -736,6 +606,12 @@ def copy_and_convert_attachments(attachments, mappings):
             'messageId': att.get('messageId')
         })
 
+    # sips runs out of process, so threads are enough to keep every core busy
+    if heic_tasks:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 4) as executor:
+            converted = sum(executor.map(convert_heic_to_jpeg, heic_tasks))
+
     print(f"  ✅ Copied {copied} files, converted {converted} HEIC images")
     if skipped:
         print(f"  ⚠️  Skipped {skipped} (not found)")
@@ -754,57 +630,56 @@ def cmd_full_export():
 
     # Step 1: Load or create mappings
     print("\n📇 Step 1: Loading contact mappings...")
-    mappings = load_mappings()
-    print(f"  Loaded {len(mappings.get('phone_to_name', {}))} phone mappings")
-    print(f"  Loaded {len(mappings.get('group_chats', {}))} group chat mappings")
-
-    # Step 2: Query group chat participants
-    print("\n👥 Step 2: Querying group chat participants...")
-    db_path = find_chat_db()
-    if db_path:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        group_chats = query_group_chat_participants(cursor)
-        conn.close()
-
-        # Resolve participant names
-        resolve_participant_names(group_chats, mappings.get('phone_to_name', {}))
-        mappings['group_chats'] = group_chats
-        save_mappings(mappings)
-        print(f"  ✅ Found {len(group_chats)} group chats")
-
-    # Step 3: Extract messages
-    print("\n💬 Step 3: Extracting messages...")
-    data = extract_messages(mappings, limit=MESSAGE_LIMIT)
-    if not data:
-        print("❌ Failed to extract messages")
-        return 1
-
-    # Step 4: Save contact mappings from extracted data
-    print("\n💾 Step 4: Saving new contact mappings...")
-    new_mappings = 0
-    for contact in data['contacts']:
-        if not contact.get('isGroupChat'):
-            phone = contact.get('phone', '')
-            name = contact.get('name', '')
-            if name and not name.startswith('+') and not name.startswith('chat') and '@' not in name:
-                if phone and phone not in mappings['phone_to_name']:
-                    mappings['phone_to_name'][phone] = name
-                    cleaned = re.sub(r'\D', '', phone)
-                    if cleaned:
-                        mappings['phone_to_name'][cleaned] = name
-                        mappings['phone_to_name'][f"+{cleaned}"] = name
-                    new_mappings += 1
-
-    if new_mappings:
-        save_mappings(mappings)
-        print(f"  ✅ Added {new_mappings} new contact mappings")
-
-    # Step 5: Resolve unresolved contacts via AppleScript
-    print("\n🔍 Step 5: Resolving contacts via macOS Contacts...")
-    resolved_count = resolve_unresolved_contacts(data, mappings, limit=100)
-    if resolved_count == 0:
-        print("  ✅ All contacts already resolved")
+    # Mapping changes from steps 1-5 are written once, when the block completes
+    with mappings_transaction() as mappings:
+        print(f"  Loaded {len(mappings.get('phone_to_name', {}))} phone mappings")
+        print(f"  Loaded {len(mappings.get('group_chats', {}))} group chat mappings")
+
+        # Step 2: Query group chat participants
+        print("\n👥 Step 2: Querying group chat participants...")
+        db_path = find_chat_db()
+        if db_path:
+            conn = connect_read_only(db_path)
+            cursor = conn.cursor()
+            group_chats = query_group_chat_participants(cursor)
+            conn.close()
+
+            # Resolve participant names
+            resolve_participant_names(group_chats, mappings.get('phone_to_name', {}))
+            mappings['group_chats'] = group_chats
+            print(f"  ✅ Found {len(group_chats)} group chats")
+
+        # Step 3: Extract messages
+        print("\n💬 Step 3: Extracting messages...")
+        data = extract_messages(mappings, limit=MESSAGE_LIMIT)
+        if not data:
+            print("❌ Failed to extract messages")
+            return 1
+
+        # Step 4: Save contact mappings from extracted data
+        print("\n💾 Step 4: Saving new contact mappings...")
+        new_mappings = 0
+        for contact in data['contacts']:
+            if not contact.get('isGroupChat'):
+                phone = contact.get('phone', '')
+                name = contact.get('name', '')
+                if name and not name.startswith('+') and not name.startswith('chat') and '@' not in name:
+                    if phone and phone not in mappings['phone_to_name']:
+                        mappings['phone_to_name'][phone] = name
+                        cleaned = phone.translate(DIGITS_ONLY)
+                        if cleaned:
+                            mappings['phone_to_name'][cleaned] = name
+                            mappings['phone_to_name'][f"+{cleaned}"] = name
+                        new_mappings += 1
+
+        if new_mappings:
+            print(f"  ✅ Added {new_mappings} new contact mappings")
+
+        # Step 5: Resolve unresolved contacts via AppleScript
+        print("\n🔍 Step 5: Resolving contacts via macOS Contacts...")
+        resolved_count = resolve_unresolved_contacts(data, mappings, limit=100)
+        if resolved_count == 0:
+            print("  ✅ All contacts already resolved")
 
     # Step 6: Extract attachments
     print("\n📎 Step 6: Extracting attachments...")
@@ -844,20 +719,18 @@ def cmd_update():
         print("⚠️  No existing data found. Running full export instead.")
         return cmd_full_export()
 
-    # Get last message date
-    last_date = None
+    # Get the last message ROWID; message ids are chat.db ROWIDs
+    last_rowid = None
     if existing.get('messages'):
-        dates = [m['date'] for m in existing['messages'] if m.get('date')]
-        if dates:
-            last_date = datetime.fromisoformat(max(dates))
-            print(f"  Last message date: {last_date}")
+        last_rowid = max(m['id'] for m in existing['messages'])
+        print(f"  Last message ID: {last_rowid}")
 
     # Load mappings
     mappings = load_mappings()
 
     # Extract new messages
     print("\n💬 Extracting new messages...")
-    new_data = extract_messages(mappings, limit=10000, since_date=last_date)
+    new_data = extract_messages(mappings, limit=10000, since_rowid=last_rowid)
 
     if not new_data or not new_data['messages']:
         print("  ℹ️  No new messages found")
@@ -869,9 +742,6 @@ def cmd_update():
     new_messages = [m for m in new_data['messages'] if m['id'] not in existing_ids]
 
     if new_messages:
-        # Build lookup from new contact ID -> phone/chat_identifier
-        new_contact_lookup = {c['id']: c for c in new_data['contacts']}
-
         # Build lookup from phone/chat_identifier -> existing contact ID
         existing_phone_to_id = {}
         for c in existing['contacts']:
@@ -881,7 +751,7 @@ def cmd_update():
                 existing_phone_to_id[phone] = c['id']
                 # Also map normalized phone (for phone numbers)
                 if not phone.startswith('chat'):
-                    cleaned = re.sub(r'\D', '', phone)
+                    cleaned = phone.translate(DIGITS_ONLY)
                     if cleaned:
                         existing_phone_to_id[cleaned] = c['id']
                         existing_phone_to_id[f"+{cleaned}"] = c['id']
@@ -903,7 +773,7 @@ def cmd_update():
             if phone in existing_phone_to_id:
                 existing_id = existing_phone_to_id[phone]
             else:
-                cleaned = re.sub(r'\D', '', phone)
+                cleaned = phone.translate(DIGITS_ONLY)
                 if cleaned in existing_phone_to_id:
                     existing_id = existing_phone_to_id[cleaned]
 
@@ -925,12 +795,14 @@ def cmd_update():
             if old_contact_id in new_to_existing_id:
                 msg['contactId'] = new_to_existing_id[old_contact_id]
 
-        existing['messages'] = new_messages + existing['messages']
+        # Prepend in place rather than building a concatenated copy of the whole history
+        existing['messages'][:0] = new_messages
 
         # Resolve any new unresolved contacts via AppleScript
         if new_contacts_added > 0:
             print(f"\n🔍 Resolving {new_contacts_added} new contacts...")
-            resolve_unresolved_contacts(existing, mappings, limit=50)
+            if resolve_unresolved_contacts(existing, mappings, limit=50):
+                save_mappings(mappings)
 
         # Recalculate statistics
         existing['statistics'] = calculate_statistics(existing['messages'], existing['contacts'])
@@ -981,7 +853,7 @@ def cmd_contacts():
         # Update mappings
         for phone, name in resolved.items():
             mappings['phone_to_name'][phone] = name
-            cleaned = re.sub(r'\D', '', phone)
+            cleaned = phone.translate(DIGITS_ONLY)
             if cleaned:
                 mappings['phone_to_name'][cleaned] = name
                 mappings['phone_to_name'][f"+{cleaned}"] = name
@@ -8,21 +8,22 @@ These mappings are then applied during extraction so you don't
 have to re-resolve contacts every time.
 """
 
-import json
-import sqlite3
 import os
-import re
 from pathlib import Path
 from collections import defaultdict
 
+from export_utils import (
+    build_phone_index, connect_read_only, iter_contacts, mapping_keys, read_json,
+    resolve_contact_name, write_json,
+)
+
 MAPPINGS_FILE = 'contact_mappings.json'
 DATA_FILE = 'imessage_data.json'
 
 def load_mappings():
     """Load existing mappings or create default"""
     if os.path.exists(MAPPINGS_FILE):
-        with open(MAPPINGS_FILE, 'r') as f:
-            return json.load(f)
+        return read_json(MAPPINGS_FILE)
     return {
         "version": 1,
         "description": "Persistent contact and group chat mappings",
@@ -32,55 +33,30 @@ def load_mappings():
 
 def save_mappings(mappings):
     """Save mappings to file"""
-    with open(MAPPINGS_FILE, 'w') as f:
-        json.dump(mappings, f, indent=2)
+    write_json(MAPPINGS_FILE, mappings, pretty=True)
     print(f"✅ Saved mappings to {MAPPINGS_FILE}")
 
-def clean_phone_number(phone):
-    """Normalize phone number for consistent matching"""
-    if not phone:
-        return ""
-    cleaned = re.sub(r'\D', '', str(phone))
-    if len(cleaned) == 10:
-        cleaned = '1' + cleaned
-    return cleaned
-
 def extract_contacts_from_json():
     """Extract resolved contact names from current JSON"""
     if not os.path.exists(DATA_FILE):
         print(f"❌ {DATA_FILE} not found")
         return {}
 
-    with open(DATA_FILE, 'r') as f:
-        data = json.load(f)
-
     phone_to_name = {}
 
-    for contact in data.get('contacts', []):
+    # Only the contacts are needed, so the messages are never loaded
+    for contact in iter_contacts(DATA_FILE):
         phone = contact.get('phone', '')
         name = contact.get('name', '')
 
-        # Skip if name is just a phone number or chat ID
-        if not name or name.startswith('+') or name.startswith('chat') or '@' in name:
+        # Skip group chats, contacts without a phone, and names that are
+        # just a phone number, chat ID or email; cheapest checks first
+        if (not name or not phone or contact.get('isGroupChat') or phone.startswith('chat')
+                or name.startswith('+') or name.startswith('chat') or '@' in name):
             continue
 
-        # Skip group chats for phone mapping
-        if contact.get('isGroupChat') or phone.startswith('chat'):
-            continue
-
-        # Store mapping with normalized phone
-        if phone:
-            # Store original format
-            phone_to_name[phone] = name
-
-            # Also store normalized format for matching
-            cleaned = clean_phone_number(phone)
-            if cleaned:
-                phone_to_name[f"+{cleaned}"] = name
-                phone_to_name[cleaned] = name
-                # Last 10 digits
-                if len(cleaned) >= 10:
-                    phone_to_name[cleaned[-10:]] = name
+        # Store mapping under the original and normalized formats
+        phone_to_name.update(dict.fromkeys(mapping_keys(phone), name))
 
     return phone_to_name
 
@@ -97,35 +73,30 @@ def query_group_chat_participants():
     group_chats = {}
 
     try:
-        conn = sqlite3.connect(str(db_path))
+        conn = connect_read_only(db_path)
         cursor = conn.cursor()
 
-        # Find all group chats (chat_identifier starts with 'chat')
+        # Find all group chats (chat_identifier starts with 'chat') and their
+        # participants with one join, instead of a participant query per chat
         cursor.execute("""
-            SELECT ROWID, chat_identifier, display_name
-            FROM chat
-            WHERE chat_identifier LIKE 'chat%'
+            SELECT c.ROWID, c.chat_identifier, c.display_name, h.id
+            FROM chat c
+            JOIN chat_handle_join chj ON chj.chat_id = c.ROWID
+            JOIN handle h ON h.ROWID = chj.handle_id
+            WHERE c.chat_identifier LIKE 'chat%'
+            ORDER BY c.ROWID
         """)
 
-        chats = cursor.fetchall()
-        print(f"Found {len(chats)} group chats")
-
-        for chat_rowid, chat_id, display_name in chats:
-            # Get participants for this chat
-            cursor.execute("""
-                SELECT h.id
-                FROM handle h
-                JOIN chat_handle_join chj ON h.ROWID = chj.handle_id
-                WHERE chj.chat_id = ?
-            """, (chat_rowid,))
-
-            participants = [row[0] for row in cursor.fetchall()]
-
-            if participants:
+        current_rowid = None
+        for chat_rowid, chat_id, display_name, handle_id in cursor:
+            if chat_rowid != current_rowid:
+                current_rowid = chat_rowid
+                participants = []
                 group_chats[chat_id] = {
                     "display_name": display_name or "",
                     "participants": participants
                 }
+            participants.append(handle_id)
 
         conn.close()
 
@@ -138,32 +109,28 @@ def query_group_chat_participants():
 
 def resolve_participant_names(group_chats, phone_to_name):
     """Resolve participant phone numbers to names where possible"""
+    # Index the mappings once, so each participant is one or two dict lookups
+    phone_index = build_phone_index(phone_to_name)
     for chat_id, chat_info in group_chats.items():
         if chat_info.get("display_name"):
             # Already has a display name set in iMessage
             continue
 
-        # Try to resolve participant names
+        # Resolve participant names until four are found; the rest are only counted
+        participants = chat_info.get("participants", [])
         resolved_names = []
-        for participant in chat_info.get("participants", []):
-            # Try direct match
-            name = phone_to_name.get(participant)
-
-            # Try normalized match
-            if not name:
-                cleaned = clean_phone_number(participant)
-                name = phone_to_name.get(cleaned) or phone_to_name.get(f"+{cleaned}")
-                if not name and len(cleaned) >= 10:
-                    name = phone_to_name.get(cleaned[-10:])
-
+        for participant in participants:
+            name = resolve_contact_name(participant, phone_to_name, phone_index)
             if name:
                 resolved_names.append(name)
+                if len(resolved_names) == 4:
+                    break
 
         # Create display name from resolved participants
         if resolved_names:
-            chat_info["resolved_display_name"] = ", ".join(resolved_names[:4])
-            if len(resolved_names) > 4:
-                chat_info["resolved_display_name"] += f" +{len(resolved_names) - 4} more"
+            chat_info["resolved_display_name"] = ", ".join(resolved_names)
+            if len(resolved_names) == 4 and len(participants) > 4:
+                chat_info["resolved_display_name"] += f" +{len(participants) - 4} more"
 
 def main():
     print("=" * 60)
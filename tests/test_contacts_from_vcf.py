@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Tests for the VCF parsing in contacts_from_vcf.py
+"""
+
+import io
+import os
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import contacts_from_vcf
+
+
+class ParseVcfFileTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def parse(self, text):
+        with open('contacts.vcf', 'w', encoding='utf-8') as f:
+            f.write(text)
+        with redirect_stdout(io.StringIO()):
+            return contacts_from_vcf.parse_vcf_file()
+
+    def test_unterminated_card_is_not_merged_into_the_next(self):
+        contacts_map = self.parse(
+            "BEGIN:VCARD\n"
+            "VERSION:3.0\n"
+            "FN:Broken Card\n"
+            "TEL;TYPE=CELL:(555) 111-2222\n"
+            "BEGIN:VCARD\n"
+            "VERSION:3.0\n"
+            "FN:Jane Doe\n"
+            "TEL;TYPE=CELL:(555) 333-4444\n"
+            "END:VCARD\n"
+        )
+
+        self.assertEqual(contacts_map.get('+15553334444'), 'Jane Doe')
+        self.assertEqual(contacts_map.get('15553334444'), 'Jane Doe')
+        self.assertNotIn('+15551112222', contacts_map)
+        self.assertNotIn('Broken Card', contacts_map.values())
+
+    def test_terminated_cards_are_all_parsed(self):
+        contacts_map = self.parse(
+            "BEGIN:VCARD\nN:Doe;John;;;\nTEL:555-111-2222\nEND:VCARD\n"
+            "BEGIN:VCARD\nFN:Jane Doe\nTEL:555-333-4444\nEND:VCARD\n"
+        )
+
+        self.assertEqual(contacts_map.get('+15551112222'), 'John Doe')
+        self.assertEqual(contacts_map.get('+15553334444'), 'Jane Doe')
+
+
+if __name__ == '__main__':
+    unittest.main()
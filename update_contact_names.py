@@ -4,26 +4,50 @@ Update contact names by resolving them from macOS Contacts.
 Now saves to persistent contact_mappings.json for reuse across extractions.
 """
 
-import json
-import sqlite3
 import os
-import subprocess
-import re
+import shutil
 from pathlib import Path
+from functools import lru_cache
+
+from export_utils import (
+    DIGITS_ONLY, connect_read_only, lookup_contacts_via_applescript, mapping_keys, read_json, write_json,
+)
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 MAPPINGS_FILE = 'contact_mappings.json'
+# The index holds every name and number in the address book, so it lives in the user's cache, owner-only
+CONTACTS_INDEX_FILE = Path.home() / "Library/Caches/imessage-exporter/contacts_index.json"
+
+# Constant SQL, so SQLite prepares it once and no phone text is ever spliced into a query
+CONTACT_NUMBERS_QUERY = """
+    SELECT pn.ZFULLNUMBER,
+        TRIM(COALESCE(p.ZFIRSTNAME, '') || ' ' || COALESCE(p.ZLASTNAME, '')) as name
+    FROM ZABCDPHONENUMBER pn
+    JOIN ZABCDRECORD p ON pn.ZOWNER = p.Z_PK
+"""
+
+def load_contacts(path):
+    """Return the contacts in a data file, plus the full data when it had to be parsed anyway"""
+    if ijson:
+        # Stream just the contacts; the full file is only parsed if a name changes
+        with open(path, 'rb') as f:
+            return list(ijson.items(f, 'contacts.item')), None
+    data = read_json(path)
+    return data.get('contacts', []), data
 
 def load_mappings():
     """Load existing mappings"""
     if os.path.exists(MAPPINGS_FILE):
-        with open(MAPPINGS_FILE, 'r') as f:
-            return json.load(f)
+        return read_json(MAPPINGS_FILE)
     return {"version": 1, "phone_to_name": {}, "group_chats": {}}
 
 def save_mappings(mappings):
     """Save mappings to file"""
-    with open(MAPPINGS_FILE, 'w') as f:
-        json.dump(mappings, f, indent=2)
+    write_json(MAPPINGS_FILE, mappings, pretty=True)
     print(f"✅ Saved mappings to {MAPPINGS_FILE}")
 
 def find_contacts_database():
@@ -60,10 +84,11 @@ def find_contacts_database():
     
     return None
 
+@lru_cache(maxsize=8192)
 def clean_phone_number(phone):
     """Clean and normalize phone number"""
     # Remove all non-digit characters
-    cleaned = re.sub(r'\D', '', phone)
+    cleaned = phone.translate(DIGITS_ONLY)
     
     # Handle different lengths
     if len(cleaned) == 10:  # US number without country code
@@ -73,116 +98,86 @@ def clean_phone_number(phone):
     
     return cleaned
 
-def resolve_contact_via_applescript(identifier):
-    """Resolve contact name using AppleScript"""
-    try:
-        # Clean the identifier
-        identifier = identifier.strip()
-        
-        # AppleScript to search contacts
-        script = f'''
-        on run
-            tell application "Contacts"
-                set foundPeople to {{}}
-                
-                -- Search by phone number
-                try
-                    set foundPeople to foundPeople & (every person whose value of every phone contains "{identifier}")
-                end try
-                
-                -- Search by email
-                try
-                    set foundPeople to foundPeople & (every person whose value of every email contains "{identifier}")
-                end try
-                
-                if (count of foundPeople) > 0 then
-                    set thePerson to item 1 of foundPeople
-                    set firstName to first name of thePerson
-                    set lastName to last name of thePerson
-                    
-                    if firstName is missing value then set firstName to ""
-                    if lastName is missing value then set lastName to ""
-                    
-                    if firstName is not "" and lastName is not "" then
-                        return firstName & " " & lastName
-                    else if firstName is not "" then
-                        return firstName
-                    else if lastName is not "" then
-                        return lastName
-                    else
-                        return ""
-                    end if
-                else
-                    return ""
-                end if
-            end tell
-        end run
-        '''
-        
-        # Run the AppleScript
-        result = subprocess.run(['osascript', '-e', script], 
-                              capture_output=True, text=True, timeout=5)
-        
-        if result.returncode == 0 and result.stdout.strip():
-            return result.stdout.strip()
+def contacts_db_stamp(db_path):
+    """Return the modification times and sizes of a Contacts database and its write-ahead log"""
+    stamp = []
+    for path in (db_path, f"{db_path}-wal"):
+        try:
+            st = os.stat(path)
+            stamp += [st.st_mtime_ns, st.st_size]
+        except OSError:
+            stamp += [0, 0]
+    return stamp
+
+def build_contacts_index(db_path):
+    """Index every phone number in the database by its full digits and by its last 10 and last 7 digits"""
+    conn = connect_read_only(db_path)
+    cursor = conn.cursor()
     
-    except Exception as e:
-        print(f"AppleScript error for {identifier}: {e}")
+    # Read every phone number once, instead of scanning the table per phone with LIKE
+    cursor.execute(CONTACT_NUMBERS_QUERY)
     
-    return None
+    by_digits, by_last10, by_last7 = {}, {}, {}
+    for number, name in cursor:
+        digits = (number or '').translate(DIGITS_ONLY)
+        if not name or not digits:
+            continue
+        by_digits.setdefault(digits, name)
+        if len(digits) >= 10:
+            by_last10.setdefault(digits[-10:], name)
+        if len(digits) >= 7:
+            by_last7.setdefault(digits[-7:], name)
+    
+    conn.close()
+    return by_digits, by_last10, by_last7
+
+def load_contacts_index(db_path):
+    """Load the phone index for a database, rebuilding the cached copy only when the database has changed"""
+    source = str(db_path)
+    stamp = contacts_db_stamp(db_path)
+    try:
+        cached = read_json(CONTACTS_INDEX_FILE)
+        if cached.get("source") == source and cached.get("stamp") == stamp:
+            return cached["by_digits"], cached["by_last10"], cached["by_last7"]
+    except Exception:
+        pass  # Missing or unreadable cache, rebuild it
+    
+    by_digits, by_last10, by_last7 = build_contacts_index(db_path)
+    try:
+        CONTACTS_INDEX_FILE.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        # Create the file as 0600 before any names are written to it
+        os.close(os.open(CONTACTS_INDEX_FILE, os.O_WRONLY | os.O_CREAT, 0o600))
+        write_json(CONTACTS_INDEX_FILE, {
+            "source": source,
+            "stamp": stamp,
+            "by_digits": by_digits,
+            "by_last10": by_last10,
+            "by_last7": by_last7
+        })
+    except OSError as e:
+        print(f"Could not cache contacts index: {e}")
+    return by_digits, by_last10, by_last7
 
 def resolve_contacts_from_database(db_path, phone_numbers):
     """Resolve multiple contacts from the database"""
     resolved = {}
     
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        by_digits, by_last10, by_last7 = load_contacts_index(db_path)
         
-        # Query to get contact names - try different matching strategies
+        # Try the exact number, then the last 10 digits, then the last 7
         for phone in phone_numbers:
             cleaned = clean_phone_number(phone)
+            if not cleaned:
+                continue  # Emails and other identifiers without digits
             
-            # Try multiple matching strategies
-            queries = [
-                # Exact match on cleaned number
-                f"""
-                SELECT DISTINCT 
-                    COALESCE(p.ZFIRSTNAME, '') || ' ' || COALESCE(p.ZLASTNAME, '') as name
-                FROM ZABCDPHONENUMBER pn
-                JOIN ZABCDRECORD p ON pn.ZOWNER = p.Z_PK
-                WHERE REPLACE(REPLACE(REPLACE(REPLACE(pn.ZFULLNUMBER, ' ', ''), '-', ''), '(', ''), ')', '') LIKE '%{cleaned}%'
-                """,
-                # Last 10 digits match
-                f"""
-                SELECT DISTINCT 
-                    COALESCE(p.ZFIRSTNAME, '') || ' ' || COALESCE(p.ZLASTNAME, '') as name
-                FROM ZABCDPHONENUMBER pn
-                JOIN ZABCDRECORD p ON pn.ZOWNER = p.Z_PK
-                WHERE REPLACE(REPLACE(REPLACE(REPLACE(pn.ZFULLNUMBER, ' ', ''), '-', ''), '(', ''), ')', '') LIKE '%{cleaned[-10:]}%'
-                """ if len(cleaned) >= 10 else None,
-                # Last 7 digits match
-                f"""
-                SELECT DISTINCT 
-                    COALESCE(p.ZFIRSTNAME, '') || ' ' || COALESCE(p.ZLASTNAME, '') as name
-                FROM ZABCDPHONENUMBER pn
-                JOIN ZABCDRECORD p ON pn.ZOWNER = p.Z_PK
-                WHERE REPLACE(REPLACE(REPLACE(REPLACE(pn.ZFULLNUMBER, ' ', ''), '-', ''), '(', ''), ')', '') LIKE '%{cleaned[-7:]}%'
-                """ if len(cleaned) >= 7 else None,
-            ]
-            
-            for query in queries:
-                if query:
-                    try:
-                        cursor.execute(query)
-                        result = cursor.fetchone()
-                        if result and result[0].strip():
-                            resolved[phone] = result[0].strip()
-                            break
-                    except:
-                        continue
-        
-        conn.close()
+            name = (
+                by_digits.get(cleaned)
+                or (by_last10.get(cleaned[-10:]) if len(cleaned) >= 10 else None)
+                or (by_last7.get(cleaned[-7:]) if len(cleaned) >= 7 else None)
+            )
+            if name:
+                resolved[phone] = name
         
     except Exception as e:
         print(f"Database error: {e}")
@@ -192,23 +187,22 @@ def resolve_contacts_from_database(db_path, phone_numbers):
 def update_contact_names():
     """Update contact names in imessage_data.json"""
     
-    # Load the JSON data
+    # Load the contacts from the JSON data
     print("Loading imessage_data.json...")
-    with open('imessage_data.json', 'r') as f:
-        data = json.load(f)
+    contacts, data = load_contacts('imessage_data.json')
     
-    if not data.get('contacts'):
+    if not contacts:
         print("No contacts found in data")
         return
     
-    print(f"Found {len(data['contacts'])} contacts to process")
+    print(f"Found {len(contacts)} contacts to process")
     
     # Find contacts database
     db_path = find_contacts_database()
     
     # Collect all phone numbers that need resolution
     phones_to_resolve = {}
-    for contact in data['contacts']:
+    for contact in contacts:
         phone = contact.get('phone', '')
         name = contact.get('name', '')
         
@@ -235,13 +229,7 @@ def update_contact_names():
     unresolved = [p for p in phones_to_resolve if p not in resolved_names]
     if unresolved:
         print(f"Attempting AppleScript resolution for {len(unresolved)} remaining contacts...")
-        for i, phone in enumerate(unresolved):
-            if i % 10 == 0:
-                print(f"  Processing {i}/{len(unresolved)}...")
-            
-            name = resolve_contact_via_applescript(phone)
-            if name:
-                resolved_names[phone] = name
+        resolved_names.update(lookup_contacts_via_applescript(unresolved))
     
     # Save resolved names to persistent mappings
     if resolved_names:
@@ -249,29 +237,24 @@ def update_contact_names():
         mappings = load_mappings()
 
         # Add normalized variants for each resolved name
+        phone_to_name = mappings["phone_to_name"]
         for phone, name in resolved_names.items():
-            mappings["phone_to_name"][phone] = name
-            # Also store normalized versions
-            cleaned = clean_phone_number(phone)
-            if cleaned:
-                mappings["phone_to_name"][cleaned] = name
-                mappings["phone_to_name"][f"+{cleaned}"] = name
-                if len(cleaned) >= 10:
-                    mappings["phone_to_name"][cleaned[-10:]] = name
+            phone_to_name.update(dict.fromkeys(mapping_keys(phone), name))
 
         save_mappings(mappings)
 
-    # Update the contacts in current JSON
+    # Update the contacts in current JSON, noting the ones still unresolved in the same pass
     updated_count = 0
-    for contact in data['contacts']:
+    still_unresolved = []
+    for contact in contacts:
         phone = contact.get('phone', '')
-        if phone in resolved_names:
-            old_name = contact.get('name', '')
-            new_name = resolved_names[phone]
-            if old_name != new_name:
-                print(f"  {old_name} -> {new_name}")
-                contact['name'] = new_name
-                updated_count += 1
+        name = contact.get('name', '')
+        if phone in resolved_names and name != resolved_names[phone]:
+            print(f"  {name} -> {resolved_names[phone]}")
+            name = contact['name'] = resolved_names[phone]
+            updated_count += 1
+        if name.startswith('+') or '@' in name:
+            still_unresolved.append(name)
 
     print(f"\nUpdated {updated_count} contact names in JSON")
 
@@ -279,14 +262,17 @@ def update_contact_names():
     if updated_count > 0:
         # Backup original
         print("Creating backup...")
-        with open('imessage_data_backup.json', 'w') as f:
-            with open('imessage_data.json', 'r') as original:
-                f.write(original.read())
+        shutil.copyfile('imessage_data.json', 'imessage_data_backup.json')
 
-        # Save updated data
+        # Save updated data, parsing the full file now if only the contacts were streamed
         print("Saving updated data...")
-        with open('imessage_data.json', 'w') as f:
-            json.dump(data, f, indent=2)
+        if data is None:
+            data = read_json('imessage_data.json')
+            for contact in data['contacts']:
+                phone = contact.get('phone', '')
+                if phone in resolved_names:
+                    contact['name'] = resolved_names[phone]
+        write_json('imessage_data.json', data)
 
         print("Done! Refresh your browser to see the updated contact names.")
         print("💾 Mappings saved - these will persist across future extractions!")
@@ -294,12 +280,6 @@ def update_contact_names():
         print("No contacts were updated.")
     
     # Show summary of remaining unresolved contacts
-    still_unresolved = []
-    for contact in data['contacts']:
-        name = contact.get('name', '')
-        if name.startswith('+') or '@' in name:
-            still_unresolved.append(name)
-    
     if still_unresolved:
         print(f"\nStill unresolved ({len(still_unresolved)} contacts):")
         for name in still_unresolved[:10]: